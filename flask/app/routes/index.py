@@ -1,9 +1,152 @@
-from flask import jsonify, render_template, request
+import gzip
+import itertools
+import time
+
+from cStringIO import StringIO
+from functools import wraps
+
+from flask import g, json, jsonify, render_template, request, stream_with_context, Response
 
 from app import app
 
+from src import forecast_format
+from src import metrics
+from src import model_pool
 from src import pipeline_global as Pipeline
-Pipeline.init_model()
+
+# the model loads in the background, so the app can bind and serve the map
+# right away; the api answers 503 until /readyz says the model is ready
+_model_pool = None
+if Pipeline.num_model_workers > 0:
+  # every worker process restores and warms up its own copy of the model
+  _model_pool = model_pool.ModelPool(Pipeline.num_model_workers, Pipeline.__name__,
+                                     call_timeout=Pipeline.model_call_timeout,
+                                     passthrough_errors=(Pipeline.UnknownDataset, Pipeline.ModelUnavailable,
+                                                         Pipeline.InvalidRequest))
+else:
+  Pipeline.init_model_in_background()
+
+def is_model_ready():
+  if _model_pool is not None:
+    return _model_pool.is_ready()
+  return Pipeline.is_model_ready()
+
+def model_load_error():
+  if _model_pool is not None:
+    return _model_pool.load_error()
+  return Pipeline.model_load_error()
+
+@app.before_request
+def start_timer():
+  g.request_start = time.time()
+  metrics.start_request()
+
+def _record_request(endpoint, status, start):
+  metrics.inc('forecast_requests_total', endpoint=endpoint, status=status)
+  metrics.observe('forecast_request_seconds', time.time() - start, endpoint=endpoint)
+  if endpoint.startswith('/api/'):
+    # model calls made by this request in this process, workers and the
+    # micro batcher count theirs elsewhere
+    metrics.observe('forecast_request_model_calls', metrics.request_model_calls(),
+                    buckets=metrics.count_buckets, endpoint=endpoint)
+
+@app.after_request
+def record_request(response):
+  endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+  if response.is_streamed:
+    # recorded once the whole body has been sent, so the latency and model
+    # calls cover the rollout. The body is generated on this thread.
+    status, start = response.status_code, g.request_start
+    response.call_on_close(lambda: _record_request(endpoint, status, start))
+  else:
+    _record_request(endpoint, response.status_code, g.request_start)
+  return response
+
+def requires_model(route):
+  @wraps(route)
+  def wrapper(*args, **kwargs):
+    if not is_model_ready():
+      response = jsonify({'error': 'model is not ready'})
+      response.status_code = 503
+      response.headers['Retry-After'] = '1'
+      return response
+    return route(*args, **kwargs)
+  return wrapper
+
+@app.errorhandler(model_pool.WorkerUnavailable)
+def worker_unavailable(error):
+  # a pool worker died or timed out, dead workers are restarted
+  response = jsonify({'error': str(error)})
+  response.status_code = 503
+  response.headers['Retry-After'] = '1'
+  return response
+
+@app.errorhandler(Pipeline.UnknownDataset)
+def unknown_dataset(error):
+  response = jsonify({'error': error.args[0]})
+  response.status_code = 404
+  return response
+
+@app.errorhandler(Pipeline.ModelUnavailable)
+def model_unavailable(error):
+  # the dataset's files are there but its model failed to load
+  response = jsonify({'error': str(error)})
+  response.status_code = 503
+  response.headers['Retry-After'] = '5'
+  return response
+
+@app.errorhandler(Pipeline.InvalidRequest)
+def invalid_request(error):
+  # bad ETC placements or optimize parameters
+  response = jsonify({'error': str(error)})
+  response.status_code = 400
+  return response
+
+def requires_dataset(route):
+  # ?dataset=<name> picks the country, guinea when it is left out. Countries
+  # without a history file and checkpoint of their own are 404s.
+  @wraps(route)
+  def wrapper(*args, **kwargs):
+    dataset = request.args.get('dataset', Pipeline.default_dataset)
+    if not Pipeline.is_serving_dataset(dataset):
+      response = jsonify({'error': 'unknown dataset {}'.format(dataset)})
+      response.status_code = 404
+      return response
+    return route(dataset, *args, **kwargs)
+  return wrapper
+
+def extrapolate_with_cache_status(dataset, etc_dict):
+  if _model_pool is not None:
+    return _model_pool.call('extrapolate_with_cache_status', dataset, etc_dict)
+  return Pipeline.extrapolate_with_cache_status(dataset, etc_dict)
+
+def iter_extrapolate(dataset, etc_dict):
+  if _model_pool is not None:
+    # a worker returns all provinces at once
+    result, _ = extrapolate_with_cache_status(dataset, etc_dict)
+    return result.iteritems()
+  return Pipeline.iter_extrapolate(dataset, etc_dict)
+
+def extrapolate_bands(dataset, etc_dict):
+  if _model_pool is not None:
+    return _model_pool.call('extrapolate_bands', dataset, etc_dict)
+  return Pipeline.extrapolate_bands(dataset, etc_dict)
+
+def optimize_placements(dataset, budget, provinces, beam_width, top_k):
+  if _model_pool is not None:
+    return _model_pool.call('optimize_placements', dataset, budget, provinces, beam_width, top_k)
+  return Pipeline.optimize_placements(dataset, budget, provinces, beam_width, top_k)
+
+def gzipped(response):
+  # compresses the body when the client takes gzip
+  if 'gzip' not in request.accept_encodings:
+    return response
+  buf = StringIO()
+  with metrics.stage('gzip'), gzip.GzipFile(mode='wb', fileobj=buf) as f:
+    f.write(response.get_data())
+  response.set_data(buf.getvalue())
+  response.headers['Content-Encoding'] = 'gzip'
+  return response
 
 @app.route('/', methods=['GET'])
 def index():
@@ -13,11 +156,109 @@ def index():
 def tmp():
   return render_template('tmp.html')
 
+@app.route('/healthz', methods=['GET'])
+def healthz():
+  return jsonify({'status': 'ok'})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+  if is_model_ready():
+    return jsonify({'status': 'ready'})
+  # the traceback of a failed load stays in the server log
+  if model_load_error():
+    response = jsonify({'status': 'failed', 'error': 'the model failed to load'})
+  else:
+    response = jsonify({'status': 'loading'})
+  response.status_code = 503
+  return response
+
 @app.route('/api/charts', methods=['POST'])
-def charts():
-  result = dict(Pipeline.extrapolate(Pipeline.PREPROCESSED_GUINEA_DATA_EXTRA, request.json))
-  for key in result:
-    for i, elem in enumerate(result[key]):
-      # result[key] is a tuple of lists and elem is one such list
-      result[key][i] = [str(n) for n in result[key][i]]
-  return jsonify(result)
\ No newline at end of file
+@requires_model
+@requires_dataset
+def charts(dataset):
+  # plain json numbers by default, packed float32 when the client asks for it
+  with metrics.stage('parse'):
+    etc_dict = request.json
+  with metrics.stage('extrapolate'):
+    result, from_cache = extrapolate_with_cache_status(dataset, etc_dict)
+  mimetype = request.accept_mimetypes.best_match(['application/json', forecast_format.MIMETYPE])
+  with metrics.stage('serialize'):
+    if mimetype == forecast_format.MIMETYPE:
+      response = Response(forecast_format.pack_forecasts(result), mimetype=forecast_format.MIMETYPE)
+    else:
+      response = Response(json.dumps(result, separators=(',', ':')), mimetype='application/json')
+  response.headers['X-Forecast-Cache'] = 'hit' if from_cache else 'miss'
+  response.headers['Vary'] = 'Accept, Accept-Encoding'
+  return gzipped(response)
+
+@app.route('/api/charts/stream', methods=['POST'])
+@requires_model
+@requires_dataset
+def charts_stream(dataset):
+  # one json line per province, written as soon as its forecast is ready
+  etc_dict = request.json
+  # the first province is computed before the response starts, so a model
+  # that fails to load still gets its 404 or 503 and bad ETCs their 400
+  forecasts = iter_extrapolate(dataset, etc_dict)
+  first = next(forecasts, None)
+  def generate():
+    if first is None:
+      return
+    for province, series in itertools.chain([first], forecasts):
+      yield json.dumps({'province': province, 'series': series}) + '\n'
+  return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/bands', methods=['POST'])
+@requires_model
+@requires_dataset
+def bands(dataset):
+  # ensemble quantiles per province and step, same body as /api/charts
+  result = extrapolate_bands(dataset, request.json)
+  response = Response(json.dumps(result, separators=(',', ':')), mimetype='application/json')
+  response.headers['Vary'] = 'Accept-Encoding'
+  return gzipped(response)
+
+@app.route('/api/optimize', methods=['POST'])
+@requires_model
+@requires_dataset
+def optimize(dataset):
+  # {"budget": 3, "provinces": [...], "beam_width": 1, "top_k": 3}, only
+  # budget is required, ETCs may go anywhere when provinces is left out.
+  # budget, beam_width and top_k are capped by Pipeline.optimize_max_budget,
+  # optimize_max_beam_width and optimize_max_top_k.
+  params = request.json or {}
+  try:
+    budget = int(params['budget'])
+    beam_width = int(params.get('beam_width', 1))
+    top_k = int(params.get('top_k', 3))
+    result = optimize_placements(dataset, budget, params.get('provinces'), beam_width, top_k)
+  except (KeyError, TypeError, ValueError) as e:
+    response = jsonify({'error': 'bad optimize request: {}'.format(e)})
+    response.status_code = 400
+    return response
+  return gzipped(Response(json.dumps(result, separators=(',', ':')), mimetype='application/json'))
+
+@app.route('/metrics', methods=['GET'])
+def serving_metrics():
+  # prometheus text format
+  gauges = Pipeline.serving_gauges() if _model_pool is None else {}
+  if _model_pool is not None:
+    stats = _model_pool.stats()
+    gauges['forecast_model_ready'] = int(_model_pool.is_ready())
+    gauges['forecast_pool_queue_depth'] = stats['queue_depth']
+    gauges['forecast_pool_in_flight'] = stats['in_flight']
+    gauges['forecast_pool_worker_tasks'] = [({'worker': w['id']}, w['tasks']) for w in stats['workers']]
+    gauges['forecast_pool_worker_utilisation'] = [({'worker': w['id']}, w['utilisation'])
+                                                  for w in stats['workers']]
+  return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/pool', methods=['GET'])
+def pool():
+  if _model_pool is None:
+    return jsonify({'num_workers': 0})
+  return jsonify(_model_pool.stats())
+
+@app.route('/api/models', methods=['GET'])
+def loaded_models():
+  # models of the in-process backend, workers keep their own registries
+  return jsonify(Pipeline.model_registry_stats())
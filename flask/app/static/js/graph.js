@@ -104,31 +104,50 @@ $(function () {
     createChart($chart, false, initialData, initialData);
   });
 
-  (function() {
-    $.ajax({
-      contentType: 'application/json',
-      data: JSON.stringify({'macenta': 2, 'coyah': 1, 'kerouane': 1}),
-      dataType: 'json',
-      type: 'POST',
-      url: '/api/charts',
-      success: function(response, status) {
-        for (var name in response) {
-          var index = getIndex(name);
-          console.log(name + " " + index);
+  (function loadForecasts() {
+    // The server streams one json line per province, so each chart is drawn
+    // as soon as its forecast arrives instead of after the whole response.
+    // While the model is still loading the server answers 503, so wait for
+    // Retry-After and ask again.
+    var xhr = new XMLHttpRequest();
+    var parsedLength = 0;
 
-          var etc0 = stringToFloatArray(response[name][0]);
-          var etc1 = stringToFloatArray(response[name][1]);
-          console.log(etc0);
-          console.log(etc1);
+    function drawNewLines() {
+      if (xhr.status !== 200) return;
+      var text = xhr.responseText;
+      var end = text.lastIndexOf('\n');
+      if (end < parsedLength) return;
 
-          var $chart = $('[data-highcharts-chart=' + index + ']');
-          createChart($chart, false, etc0, etc1);
-        }
-      },
-      error: function() {
-          app.log("Device control failed");
+      text.slice(parsedLength, end).split('\n').forEach(function(line) {
+        if (!line) return;
+        var forecast = JSON.parse(line);
+        var index = getIndex(forecast.province);
+        console.log(forecast.province + " " + index);
+
+        var $chart = $('[data-highcharts-chart=' + index + ']');
+        createChart($chart, false, forecast.series[0], forecast.series[1]);
+      });
+      parsedLength = end + 1;
+    }
+
+    xhr.open('POST', '/api/charts/stream');
+    xhr.setRequestHeader('Content-Type', 'application/json');
+    xhr.onprogress = drawNewLines;
+    xhr.onload = function() {
+      if (xhr.status === 503) {
+        var retryAfter = parseFloat(xhr.getResponseHeader('Retry-After')) || 1;
+        console.log("Model is not ready, retrying in " + retryAfter + "s");
+        setTimeout(loadForecasts, retryAfter * 1000);
+      } else if (xhr.status === 200) {
+        drawNewLines();
+      } else {
+        console.log("Loading forecasts failed: " + xhr.status);
       }
-    });
+    };
+    xhr.onerror = function() {
+      console.log("Loading forecasts failed");
+    };
+    xhr.send(JSON.stringify({'macenta': 2, 'coyah': 1, 'kerouane': 1}));
   })();
 
   function getIndex(name) {
@@ -137,8 +156,4 @@ $(function () {
     }
     return -1;
   }
-
-  function stringToFloatArray(stringArray) {
-    return stringArray.map(parseFloat);
-  }
 });
@@ -1,2 +1,23 @@
+import argparse
+
+parser = argparse.ArgumentParser(description='Epidemic Response System server')
+parser.add_argument('--workers', type=int, default=0,
+                    help='number of model worker processes, 0 serves from the server process')
+parser.add_argument('--batch-wait-ms', type=float, default=0,
+                    help='milliseconds to collect concurrent requests into one rollout, 0 disables')
+parser.add_argument('--batch-max-scenarios', type=int, default=32,
+                    help='most scenarios rolled out together when batching requests')
+args = parser.parse_args()
+
+from src import pipeline_global as Pipeline
+Pipeline.num_model_workers = args.workers
+Pipeline.micro_batch_wait = args.batch_wait_ms / 1000.0
+Pipeline.micro_batch_max_scenarios = args.batch_max_scenarios
+
 from app import app
-app.run(host="localhost", port=1337, debug=True)
\ No newline at end of file
+if args.workers > 0 or args.batch_wait_ms > 0:
+  # requests wait on the pool or on each other, so let them in concurrently,
+  # and don't let the reloader start a second copy of the model
+  app.run(host="localhost", port=1337, debug=True, threaded=True, use_reloader=False)
+else:
+  app.run(host="localhost", port=1337, debug=True)
@@ -0,0 +1,242 @@
+# benchmark.py
+#
+#===============================================================================
+# DESCRIPTION:
+#
+# Times extrapolation and preprocessing on synthetic data shaped like
+# guinea_clean.csv, scaled up 1x, 10x and 100x. Runs offline on CPU with a
+# randomly initialised numpy model. Every stage runs in its own process so
+# its peak memory can be measured.
+#
+#===============================================================================
+# USAGE: python benchmark.py [--scales 1 10 100] [--output results.json]
+#                            [--baseline baseline.json] [--tolerance 0.2]
+#===============================================================================
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# what guinea_clean.csv looks like at 1x
+base_num_provinces = 33
+base_num_days = 344
+case_types = ['cases', 'confirmed cases', 'deaths', 'new cases', 'probable cases', 'suspected cases']
+num_timesteps = 25
+num_feats = 3
+
+stages = ['extrapolate', 'load_clean_data_dict_aligned_by_time', 'cnn_get_data']
+
+
+def scaled_size(scale):
+    # scale multiplies the number of rows; provinces and days grow by
+    # sqrt(scale) each, so 100x is 10x the provinces over 10x the days
+    factor = np.sqrt(scale)
+    return int(round(base_num_provinces * factor)), int(round(base_num_days * factor))
+
+
+def write_synthetic_clean_csv(csv_file, num_provinces, num_days, seed=0):
+    # rows are country,province,case_type,count,day,rel_lat,rel_lon like the
+    # output of preprocessing.clean_data_convert_dates_make_normalize_lat_lon.
+    # Provinces start reporting within the first 50 days, skip ~10% of the
+    # days after that, and have cumulative counts.
+    rng = np.random.RandomState(seed)
+    lat_lon = {}
+    with open(csv_file, 'wb') as f:
+        writer = csv.writer(f, delimiter=',')
+        for p in range(num_provinces):
+            province = 'province{}'.format(p)
+            rel_lat, rel_lon = rng.uniform(-1, 1, 2)
+            lat_lon[province] = (rel_lat, rel_lon)
+            first_day = rng.randint(0, 50)
+            days = [first_day] + [day for day in range(first_day + 1, num_days)
+                                  if rng.rand() > 0.1] + [num_days - 1]
+            days = sorted(set(days))
+            counts = np.cumsum(rng.poisson(0.5, (len(days), len(case_types))), axis=0)
+            for i, day in enumerate(days):
+                for k, case_type in enumerate(case_types):
+                    writer.writerow(['guinea', province, case_type, counts[i, k], day, rel_lat, rel_lon])
+    return lat_lon
+
+
+def write_synthetic_history(history_dir, num_provinces, seed=0):
+    # dataset directory like
+    # preprocessing.create_data_for_extrapolation_aligned_by_time writes
+    import dataset_format
+
+    rng = np.random.RandomState(seed)
+    provinces = ['province{}'.format(p) for p in range(num_provinces)]
+    data = np.zeros((num_provinces, num_timesteps, num_feats))
+    data[:, :, 0] = np.cumsum(rng.poisson(0.5, (num_provinces, num_timesteps)), axis=1)
+    data[:, :, 1:] = rng.uniform(-1, 1, (num_provinces, 1, 2))
+    dataset_format.save_dataset_dir(history_dir, {'data': data, 'labels': data[:, -1, 0]},
+                                    dataset_name='synthetic', num_timesteps=num_timesteps,
+                                    provinces=provinces)
+    return dict((province, tuple(data[p, 0, 1:])) for p, province in enumerate(provinces))
+
+
+def bench_extrapolate(work_dir, num_provinces, num_days):
+    import dataset_store
+    import model_registry
+    import numpy_models
+    import pipeline_global
+    import province_registry
+
+    history_file = os.path.join(work_dir, 'history')
+    lat_lon_map = write_synthetic_history(history_file, num_provinces)
+    model = model_registry.ServingModel('benchmark', 'random',
+                                        numpy_models.NumpyLSTMModel.random(num_feats=num_feats),
+                                        dataset_store.HistoryDataset(history_file),
+                                        province_registry.ProvinceRegistry(lat_lon_map))
+    etc_dict = {'province0': 2, 'province1': 1}
+
+    def run():
+        pipeline_global._extrapolate(model, [None, etc_dict])
+    return run
+
+
+def bench_load_clean(work_dir, num_provinces, num_days):
+    import preprocessing
+
+    csv_file = os.path.join(work_dir, 'synthetic_clean.csv')
+    write_synthetic_clean_csv(csv_file, num_provinces, num_days)
+
+    def run():
+        preprocessing.load_clean_data_dict_aligned_by_time(clean_csv_file=csv_file, dataset_name='synthetic')
+    return run
+
+
+def bench_cnn_get_data(work_dir, num_provinces, num_days):
+    import cnn_processing
+    import preprocessing
+
+    csv_file = os.path.join(work_dir, 'synthetic_clean.csv')
+    write_synthetic_clean_csv(csv_file, num_provinces, num_days)
+    clean_dict = preprocessing.load_clean_data_dict_aligned_by_time(clean_csv_file=csv_file,
+                                                                    dataset_name='synthetic')
+
+    def run():
+        cnn_processing.get_data(clean_dict)
+    return run
+
+
+stage_setups = {
+    'extrapolate': bench_extrapolate,
+    'load_clean_data_dict_aligned_by_time': bench_load_clean,
+    'cnn_get_data': bench_cnn_get_data,
+}
+
+
+def _peak_rss_kb():
+    # ru_maxrss is in kilobytes on linux and in bytes on os x
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak /= 1024
+    return peak
+
+
+def _run_stage(stage, scale, repeats, results):
+    work_dir = tempfile.mkdtemp(prefix='benchmark')
+    try:
+        num_provinces, num_days = scaled_size(scale)
+        run = stage_setups[stage](work_dir, num_provinces, num_days)
+        setup_rss = _peak_rss_kb()
+        times = []
+        for _ in range(repeats):
+            start = time.time()
+            run()
+            times.append(time.time() - start)
+        results.put({'stage': stage,
+                     'scale': scale,
+                     'num_provinces': num_provinces,
+                     'num_days': num_days,
+                     'repeats': repeats,
+                     'seconds': min(times),
+                     'mean_seconds': float(np.mean(times)),
+                     'setup_peak_rss_kb': setup_rss,
+                     'peak_rss_kb': _peak_rss_kb()})
+    except Exception as e:
+        results.put({'stage': stage, 'scale': scale, 'error': repr(e)})
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_benchmarks(scales, repeats=3, selected_stages=None):
+    # one fresh process per stage and scale, so peak memory isn't shared
+    results = []
+    for scale in scales:
+        for stage in selected_stages or stages:
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=_run_stage, args=(stage, scale, repeats, queue))
+            process.start()
+            result = queue.get()
+            process.join()
+            results.append(result)
+            if 'error' in result:
+                print ("{:40s} {:>5}x  failed: {}".format(stage, scale, result['error']))
+            else:
+                print ("{:40s} {:>5}x  {:9.4f}s  peak {:8d} KB".format(stage, scale, result['seconds'],
+                                                                     result['peak_rss_kb']))
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'results': results}
+
+
+def compare_to_baseline(report, baseline, tolerance=0.2):
+    # stages more than tolerance slower than in the baseline, as
+    # (stage, scale, baseline seconds, seconds). A stage that failed, or that
+    # the baseline has but the report doesn't, counts with seconds None.
+    previous = dict(((r['stage'], r['scale']), r) for r in baseline['results'] if 'error' not in r)
+    current = dict(((r['stage'], r['scale']), r) for r in report['results'])
+    regressions = []
+    for key, result in sorted(current.items()):
+        if 'error' in result:
+            regressions.append(key + (previous[key]['seconds'] if key in previous else None, None))
+        elif key in previous and result['seconds'] > previous[key]['seconds'] * (1 + tolerance):
+            regressions.append(key + (previous[key]['seconds'], result['seconds']))
+    for key in sorted(set(previous) - set(current)):
+        regressions.append(key + (previous[key]['seconds'], None))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Extrapolation and preprocessing benchmarks')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 10, 100],
+                        help='data sizes relative to guinea_clean.csv')
+    parser.add_argument('--stages', nargs='+', choices=stages, help='stages to run, all by default')
+    parser.add_argument('--repeats', type=int, default=3, help='runs per stage, the fastest counts')
+    parser.add_argument('--output', default='benchmark_results.json', help='where to write the results')
+    parser.add_argument('--baseline', help='earlier results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='fraction a stage may be slower than the baseline')
+    args = parser.parse_args()
+
+    scales = [int(scale) if scale == int(scale) else scale for scale in args.scales]
+    report = run_benchmarks(scales, args.repeats, args.stages)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print ("results written to {}".format(args.output))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report, baseline, args.tolerance)
+        for stage, scale, before, after in regressions:
+            if after is None:
+                print ("REGRESSION {} at {}x: failed or missing".format(stage, scale))
+            else:
+                print ("REGRESSION {} at {}x: {:.4f}s -> {:.4f}s".format(stage, scale, before, after))
+        if regressions:
+            sys.exit(1)
+        print ("no regressions against {}".format(args.baseline))
@@ -3,14 +3,25 @@ import sys
 import numpy as np
 import scipy.io as sio
 
+import dataset_format
+
 class DataSet(object):
-    def __init__(self, X, y, mask):
+    def __init__(self, X, y, mask, seed=None, partial_last_batch=False):
+        # seed gives the dataset its own shuffling order, independent of
+        # np.random and of the thread it is read from. partial_last_batch
+        # ends every epoch with the leftover rows instead of skipping them.
+        # mask marks the grid cells that ever have cases. It is the same for
+        # every example, so it is returned as is with every batch and never
+        # shuffled.
+        self._rng = np.random.RandomState(seed) if seed is not None else np.random
         self._data = X
         self._labels = y
         self._mask = mask
         self._epochs_completed = 0
         self._index_in_epoch = 0
         self._num_examples = self._data.shape[0]
+        self._perm = np.arange(self._num_examples)
+        self._partial_last_batch = partial_last_batch
     
     @property
     def data(self):
@@ -24,32 +35,49 @@ class DataSet(object):
     def epochs_completed(self):
         return self._epochs_completed
 
+    @property
+    def mask(self):
+        return self._mask
+
     def next_batch(self, batch_size):
+        # rows are gathered through the shuffled index, the arrays themselves
+        # are never reordered, so an epoch costs no full dataset copy
+        if not self._partial_last_batch:
+            assert batch_size <= self._num_examples
         start = self._index_in_epoch
-        self._index_in_epoch += batch_size
-        if self._index_in_epoch > self._num_examples: # if we have reached end of epoch
+        end = min(start + batch_size, self._num_examples)
+        rows = self._perm[start:end]
+        # the grid model takes one example at a time, see cnn_models.network
+        batch = (self._data[rows[0]], self._labels[rows[0]], self._mask)
+
+        # the epoch is over once no full batch (or, with partial_last_batch,
+        # no row at all) is left; the next one starts in a new order
+        self._index_in_epoch = end
+        remaining = self._num_examples - end
+        if remaining == 0 or (remaining < batch_size and not self._partial_last_batch):
             self._epochs_completed += 1
+            self._rng.shuffle(self._perm)
+            self._index_in_epoch = 0
+        return batch
 
-            # shuffle data
-            perm = np.arange(self._num_examples)
-            np.random.shuffle(perm)
-            self._data = self._data[perm]
-            self._labels = self._labels[perm]
+def read_datasets(data_path='', dataset_type='train', seed=None, partial_last_batch=False):
+    print('loading data...')
 
-            start = 0
-            self._index_in_epoch = batch_size
-            assert batch_size <= self._num_examples
-        end = self._index_in_epoch
-        return self._data[start:end][0], self._labels[start:end][0], self._mask
+    # a dataset directory (or one next to a legacy .npy of the same name) is
+    # memory mapped, and only the arrays of the wanted split are opened
+    dataset_dir = dataset_format.find_dataset_dir(data_path)
+    if dataset_dir is not None:
+        names = ['X_' + dataset_type, 'y_' + dataset_type, 'mask']
+        arrays, manifest = dataset_format.load_dataset_dir(dataset_dir, names)
+        X, y, mask = [arrays[name] for name in names]
+        print('{} data shape:'.format(dataset_type), X.shape)
+        return DataSet(X, y, np.array(mask), seed, partial_last_batch)
 
-def read_datasets(data_path='', dataset_type='train'):
-    print('loading data...')
-   
     # load data
     X_train, X_test, y_train, y_test, mask, grid_provinces_dict = np.load(data_path)
     if dataset_type == 'train':
         print('Training data shape:', X_train.shape)
-        return DataSet(X_train, y_train, mask)
+        return DataSet(X_train, y_train, mask, seed, partial_last_batch)
     elif dataset_type == 'test':
         print('Test data shape:', X_test.shape)
-        return DataSet(X_test, y_test, mask)
+        return DataSet(X_test, y_test, mask, seed, partial_last_batch)
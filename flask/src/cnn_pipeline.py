@@ -7,6 +7,10 @@ import cnn_models as models
 import sys
 import os
 import cnn_data_loader as data_loader
+import data_parallel
+import dataset_format
+import prefetcher
+import profiling
 
 from collections import defaultdict
 
@@ -19,9 +23,16 @@ tf.set_random_seed(0)
 
 parser = argparse.ArgumentParser(description='Epidemic Response System')
 parser.add_argument('-wd', '--working_directory', help='directory for storing logs')
-parser.add_argument('-sf', '--save_frequency', help='Number of epochs before saving')
+parser.add_argument('-sf', '--save_frequency', type=int, help='Number of epochs before saving')
 parser.add_argument('--model_path', help='Stored model path')
-parser.add_argument('mode', choices=('train', 'eval', 'extrapolate', 'etc_user'), help='train or eval')
+parser.add_argument('--prefetch', type=int, default=0,
+                    help='batches to prepare ahead of training on a background thread')
+parser.add_argument('--workers', type=int, default=1,
+                    help='processes training data parallel, each on its own grid sequence per update')
+parser.add_argument('--profile', action='store_true',
+                    help='write a cProfile hotspot report and a chrome trace of the run')
+parser.add_argument('--profile_dir', default='profile/', help='where --profile writes to')
+parser.add_argument('mode', choices=('train', 'eval', 'extrapolate', 'etc_user', 'scaling'), help='train or eval')
 args = parser.parse_args()
 
 # Training Constants
@@ -30,6 +41,9 @@ batch_size = 1
 num_timesteps = 10 
 num_feats = 1
 max_epoch = 601
+prefetch_batches = args.prefetch
+num_workers = args.workers # > 1 trains data parallel, see data_parallel
+shuffle_seed = 1234
 num_extrapolate = 10
 dataset_size = 135 
 updates_per_epoch = int(np.ceil(float(dataset_size) / float(batch_size)))
@@ -54,6 +68,9 @@ def get_loss(pred, gt, mask):
     return tf.mul(loss, mask)
 
 def train():
+    if num_workers > 1:
+        return train_data_parallel()
+
     with tf.device('/gpu:0'): # run on specific device
         input_tensor, pred, gt, mask = models.import_model(num_timesteps,
                                                            input_size,
@@ -62,7 +79,10 @@ def train():
         optimizer = tf.train.AdamOptimizer(learning_rate, epsilon=1.0)
         train = optimizer.minimize(loss=loss)
 
-    dataset = data_loader.read_datasets('./cnn_data.npy')
+    dataset = data_loader.read_datasets('./cnn_data.npy', seed=shuffle_seed)
+    if prefetch_batches > 0:
+        # shuffles and slices the next batches while the session runs
+        dataset = prefetcher.PrefetchingDataSet(dataset, batch_size, prefetch_batches)
     saver = tf.train.Saver()  # defaults to saving all variables
 
     # logging the loss function
@@ -86,11 +106,12 @@ def train():
             pbar.start()
             for i in range(updates_per_epoch):
                 pbar.update(i)
-                input_batch, gt_batch, mask_batch = dataset.next_batch(batch_size)
-                _, loss_value = sess.run([train, loss],
-                                         {input_tensor : input_batch,
-                                          gt : gt_batch,
-                                          mask: mask_batch})
+                with profiling.span('next_batch'):
+                    input_batch, gt_batch, mask_batch = dataset.next_batch(batch_size)
+                _, loss_value = profiling.run(sess, [train, loss],
+                                                    {input_tensor : input_batch,
+                                                     gt : gt_batch,
+                                                     mask: mask_batch})
                 training_loss += np.sum(loss_value)
 
             training_loss = training_loss/(updates_per_epoch)
@@ -112,6 +133,76 @@ def train():
                                          loss_placeholder: training_loss})
                 writer.add_summary(summary_str, global_step=epoch)
         writer.close()
+    if prefetch_batches > 0:
+        dataset.close()
+
+def _build_training_model(shard_size):
+    # the graph of one data parallel worker, the grid model takes one
+    # sequence at a time so every worker gets shard_size == batch_size
+    tf.set_random_seed(0)
+    input_tensor, pred, gt, mask = models.import_model(num_timesteps,
+                                                       input_size,
+                                                       shard_size)
+    return [input_tensor, gt, mask], get_loss(pred, gt, mask)
+
+
+def _make_optimizer():
+    return tf.train.AdamOptimizer(learning_rate, epsilon=1.0)
+
+
+def _next_shards(dataset, n):
+    # one sequence per worker, so an update averages over n sequences
+    return [dataset.next_batch(batch_size) for _ in range(n)]
+
+
+def train_data_parallel():
+    dataset = data_loader.read_datasets('./cnn_data.npy', seed=shuffle_seed)
+    if prefetch_batches > 0:
+        dataset = prefetcher.PrefetchingDataSet(dataset, batch_size, prefetch_batches)
+    updates_per_epoch = dataset.num_examples // num_workers
+    checkpoints_folder = os.path.join(working_directory, 'checkpoints')
+    trainer = data_parallel.DataParallelTrainer(_build_training_model, _make_optimizer, num_workers,
+                                                batch_size,
+                                                log_dir=os.path.join(working_directory, 'logs'))
+    try:
+        for epoch in range(max_epoch):
+            training_loss = 0.0
+
+            widgets = ["epoch #%d|" % epoch, Percentage(), Bar(), ETA()]
+            pbar = ProgressBar(updates_per_epoch, widgets=widgets)
+            pbar.start()
+            for i in range(updates_per_epoch):
+                pbar.update(i)
+                with profiling.span('next_batch'):
+                    shards = _next_shards(dataset, num_workers)
+                with profiling.span('data_parallel_step'):
+                    training_loss += trainer.step(shards)
+
+            training_loss = training_loss/(updates_per_epoch)
+            print("Loss %f" % training_loss)
+
+            # save model and summaries
+            if epoch % save_frequency == 0:
+                if not os.path.exists(checkpoints_folder):
+                    os.makedirs(checkpoints_folder)
+                trainer.save(os.path.join(checkpoints_folder, 'model.ckpt'), epoch, training_loss)
+    finally:
+        trainer.close()
+        if prefetch_batches > 0:
+            dataset.close()
+
+
+def benchmark_data_parallel(worker_counts=(1, 2, 4, 8), steps=50):
+    # training throughput at every number of workers, each update taking
+    # one sequence per worker
+    dataset = data_loader.read_datasets('./cnn_data.npy', seed=shuffle_seed)
+
+    def make_trainer(n):
+        return data_parallel.DataParallelTrainer(_build_training_model, _make_optimizer, n, batch_size)
+
+    def next_shards(n):
+        return _next_shards(dataset, n), n * batch_size
+    return data_parallel.benchmark_scaling(make_trainer, next_shards, worker_counts, steps)
 
 def evaluate(print_grid=False):
     with tf.device('/gpu:0'): # run on specific device
@@ -128,11 +219,12 @@ def evaluate(print_grid=False):
 
         all_pred, all_gt = [], []
         for i in range(updates_per_epoch):
-            input_batch, gt_batch, mask_batch = dataset.next_batch(batch_size)
-            pred_value = sess.run([pred],
-                                  {input_tensor : input_batch,
-                                   gt : gt_batch,
-                                   mask : mask_batch})
+            with profiling.span('next_batch'):
+                input_batch, gt_batch, mask_batch = dataset.next_batch(batch_size)
+            pred_value = profiling.run(sess, [pred],
+                                             {input_tensor : input_batch,
+                                              gt : gt_batch,
+                                              mask : mask_batch})
             all_pred.append(pred_value)
             all_gt.append(gt_batch)
 
@@ -152,7 +244,7 @@ def extrapolate(history_file, etc_dict=None):
                                                      batch_size)
 
     # dataset should be [num_provinces x (num_timesteps, num_feats)]
-    data, provinces = np.load(history_file)
+    data, provinces = dataset_format.load_history(history_file)
 
     saver = tf.train.Saver()
 
@@ -169,8 +261,8 @@ def extrapolate(history_file, etc_dict=None):
             new_values = []
             old_value = province_data[-1, 0]
             for t in range(num_extrapolate):
-                pred_value = sess.run([pred],
-                                      {input_tensor: province_data})[0][0][0]
+                pred_value = profiling.run(sess, [pred],
+                                                 {input_tensor: province_data})[0][0][0]
                 if pred_value < 0:
                     pred_value = 0
                 extrapolated.append(pred_value)
@@ -203,12 +295,16 @@ def extrapolate(history_file, etc_dict=None):
 
 
 if __name__ == "__main__":
+    if args.profile:
+        profiling.start(args.profile_dir, args.mode)
     if args.mode == 'train':
         train()
     elif args.mode == 'eval':
         evaluate(print_grid=False)
     elif args.mode == 'extrapolate':
         extrapolate(PREPROCESSED_GUINEA_DATA_EXTRA)
+    elif args.mode == 'scaling':
+        benchmark_data_parallel()
     elif args.mode == 'etc_user':
         etc_dict = {
             "macenta"   : 2,
@@ -1,5 +1,6 @@
 import numpy as np
 from preprocessing import *
+from dataset_format import save_dataset_dir
 from sklearn.cross_validation import train_test_split
 
 degree_interval = 0.08
@@ -78,7 +79,12 @@ def preprocess_for_cnn(clean_csv_file=CLEAN_GUINEA_DATA_PATH, dataset_name="guin
     clean_dict = load_clean_data_dict_aligned_by_time(clean_csv_file, dataset_name, num_timesteps, case_type)
     X, y, mask, grid_province_dict = get_data(clean_dict)
     X_train, X_test, y_train, y_test = get_train_test(X, y)
-    np.save('cnn_data', (X_train, X_test, y_train, y_test, mask, grid_province_dict))
+    # grid_province_dict has (x, y) keys, which json can't hold, so it goes
+    # into the manifest as [x, y, province] rows
+    save_dataset_dir('cnn_data', {'X_train': X_train, 'X_test': X_test, 'y_train': y_train,
+                                  'y_test': y_test, 'mask': mask},
+                     dataset_name=dataset_name, num_timesteps=num_timesteps, case_type=case_type,
+                     grid_provinces=[[x, y, province] for (x, y), province in sorted(grid_province_dict.items())])
 
 if __name__ == '__main__':
     preprocess_for_cnn()
@@ -30,8 +30,13 @@ LAT_LON_PROVINCES = "../data/lat-lon-provinces.csv"
 
 PREPROCESSED_GUINEA_DATA = "/Users/lisa1010/dev/nga_hacks/flask/data/preprocessed/guinea_25.npy"
 PREPROCESSED_DATA = "../data/preprocessed.npy"
+# preprocessing writes <dataset_name>_<num_timesteps>[_h<horizon>] dataset directories here
+PREPROCESSED_DIR = "../data/preprocessed/"
 
 PREPROCESSED_GUINEA_DATA_EXTRA = "/Users/lisa1010/dev/nga_hacks/flask/data/preprocessed/guinea_25_for_extrapolation.npy"
+PREPROCESSED_LIBERIA_DATA_EXTRA = "../data/preprocessed/liberia_25_for_extrapolation.npy"
+PREPROCESSED_SIERRA_DATA_EXTRA = "../data/preprocessed/sierra_25_for_extrapolation.npy"
+PREPROCESSED_ALL_THREE_COUNTRIES_DATA_EXTRA = "../data/preprocessed/all_three_countries_25_for_extrapolation.npy"
 
 COUNTRIES = ["guinea", "liberia", "sierra", "all_three_countries"]
 
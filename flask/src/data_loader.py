@@ -3,13 +3,21 @@ import sys
 import numpy as np
 import scipy.io as sio
 
+import dataset_format
+
 class DataSet(object):
-    def __init__(self, X, y):
+    def __init__(self, X, y, seed=None, partial_last_batch=False):
+        # seed gives the dataset its own shuffling order, independent of
+        # np.random and of the thread it is read from. partial_last_batch
+        # ends every epoch with the leftover rows instead of skipping them.
+        self._rng = np.random.RandomState(seed) if seed is not None else np.random
         self._data = X
         self._labels = y
         self._epochs_completed = 0
         self._index_in_epoch = 0
         self._num_examples = self._data.shape[0]
+        self._perm = np.arange(self._num_examples)
+        self._partial_last_batch = partial_last_batch
     
     @property
     def data(self):
@@ -24,37 +32,64 @@ class DataSet(object):
         return self._epochs_completed
 
     def next_batch(self, batch_size):
+        # rows are gathered through the shuffled index, the arrays themselves
+        # are never reordered, so an epoch costs no full dataset copy
+        if not self._partial_last_batch:
+            assert batch_size <= self._num_examples
         start = self._index_in_epoch
-        self._index_in_epoch += batch_size
-        if self._index_in_epoch > self._num_examples: # if we have reached end of epoch
+        end = min(start + batch_size, self._num_examples)
+        rows = self._perm[start:end]
+        # [batch_size, num_timesteps, num_feats] and [batch_size] (or
+        # [batch_size, horizon]) labels
+        batch = (self._data[rows], self._labels[rows])
+
+        # the epoch is over once no full batch (or, with partial_last_batch,
+        # no row at all) is left; the next one starts in a new order
+        self._index_in_epoch = end
+        remaining = self._num_examples - end
+        if remaining == 0 or (remaining < batch_size and not self._partial_last_batch):
             self._epochs_completed += 1
+            self._rng.shuffle(self._perm)
+            self._index_in_epoch = 0
+        return batch
 
-            # shuffle data
-            perm = np.arange(self._num_examples)
-            np.random.shuffle(perm)
-            self._data = self._data[perm]
-            self._labels = self._labels[perm]
+def pad_batch(array, batch_size):
+    # zero pads a partial last batch up to the batch_size rows a graph is
+    # built for, the rows of the lstm don't interact so the real rows'
+    # outputs don't change
+    num_rows = array.shape[0]
+    if num_rows == batch_size:
+        return array
+    padding = np.zeros((batch_size - num_rows,) + array.shape[1:], dtype=array.dtype)
+    return np.concatenate((array, padding), axis=0)
 
-            start = 0
-            self._index_in_epoch = batch_size
-            assert batch_size <= self._num_examples
-        end = self._index_in_epoch
-        return self._data[start:end][0], self._labels[start:end][0]
-
-def read_datasets(data_path='', dataset_type='train'):
+def read_datasets(data_path='', dataset_type='train', seed=None, partial_last_batch=False):
     print('loading data...')
-   
+
+    # a dataset directory (or one next to a legacy .npy of the same name) is
+    # memory mapped, and only the arrays of the wanted split are opened
+    dataset_dir = dataset_format.find_dataset_dir(data_path)
+    if dataset_dir is not None:
+        if dataset_type == 'extrapolate':
+            names = ['data', 'labels']
+        else:
+            names = ['X_' + dataset_type, 'y_' + dataset_type]
+        arrays, manifest = dataset_format.load_dataset_dir(dataset_dir, names)
+        X, y = [arrays[name] for name in names]
+        print('{} data shape:'.format(dataset_type), X.shape)
+        return DataSet(X, y, seed, partial_last_batch)
+
     if dataset_type == 'train':
     	# load data
         X_train, X_test, y_train, y_test = np.load(data_path)
         print('Training data shape:', X_train.shape)
-        return DataSet(X_train, y_train)
+        return DataSet(X_train, y_train, seed, partial_last_batch)
     elif dataset_type == 'test':
     	# load data
         X_train, X_test, y_train, y_test = np.load(data_path)
         print('Test data shape:', X_test.shape)
-        return DataSet(X_test, y_test)
+        return DataSet(X_test, y_test, seed, partial_last_batch)
     elif dataset_type == 'extrapolate':
         X, y, provinces = np.load(data_path)
         print('Test data shape:', X.shape)
-        return DataSet(X, y)
+        return DataSet(X, y, seed, partial_last_batch)
@@ -0,0 +1,221 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import traceback
+
+import numpy as np
+
+# Synchronous data parallel training on the cpu. Every worker process holds a
+# full replica of the model and its optimizer. For each update the trainer
+# hands every worker its shard of the batch, averages the gradients they send
+# back and broadcasts the average, which every replica applies through
+# gradient placeholders. The replicas start from the same checkpoint and
+# apply the same updates, so their weights stay identical and worker 0 alone
+# writes checkpoints and summaries.
+
+
+class _Replica(object):
+    # the tensorflow side of one worker, in its own graph and session.
+    # build_model(shard_size) returns (placeholders, loss), with the
+    # placeholders in the order of the shards fed to DataParallelTrainer.step
+    def __init__(self, build_model, make_optimizer, shard_size, num_threads, log_dir=None):
+        import tensorflow as tf
+
+        self._graph = tf.Graph()
+        with self._graph.as_default(), tf.device('/cpu:0'):
+            self._placeholders, self._loss = build_model(shard_size)
+            optimizer = make_optimizer()
+            grads_and_vars = [(grad, var) for grad, var in optimizer.compute_gradients(self._loss)
+                              if grad is not None]
+            self._grads = [tf.convert_to_tensor(grad) for grad, _ in grads_and_vars]
+            self._grad_placeholders = [tf.placeholder(var.dtype.base_dtype, var.get_shape())
+                                       for _, var in grads_and_vars]
+            self._apply = optimizer.apply_gradients(
+                zip(self._grad_placeholders, [var for _, var in grads_and_vars]))
+
+            self._loss_placeholder = tf.placeholder(tf.float32)
+            self._summary = tf.scalar_summary('train_loss', self._loss_placeholder)
+            self._init = tf.initialize_all_variables()
+            self._saver = tf.train.Saver()  # after the optimizer, so its slots are saved too
+        config = tf.ConfigProto(allow_soft_placement=True,
+                                intra_op_parallelism_threads=num_threads,
+                                inter_op_parallelism_threads=num_threads)
+        self._sess = tf.Session(graph=self._graph, config=config)
+        self._writer = None
+        if log_dir is not None:
+            self._writer = tf.train.SummaryWriter(log_dir, self._graph.as_graph_def())
+
+    def initialize(self, checkpoint):
+        self._sess.run(self._init)
+        return self._saver.save(self._sess, checkpoint)
+
+    def restore(self, checkpoint):
+        self._sess.run(self._init)
+        self._saver.restore(self._sess, checkpoint)
+
+    def gradients(self, shard):
+        # (summed loss, gradients) of one shard
+        feed_dict = dict(zip(self._placeholders, shard))
+        results = self._sess.run([self._loss] + self._grads, feed_dict)
+        return float(np.sum(results[0])), results[1:]
+
+    def apply(self, grads):
+        self._sess.run(self._apply, dict(zip(self._grad_placeholders, grads)))
+
+    def save(self, checkpoint, global_step, loss):
+        path = self._saver.save(self._sess, checkpoint, global_step=global_step)
+        if self._writer is not None:
+            summary_str = self._sess.run(self._summary, {self._loss_placeholder: loss})
+            self._writer.add_summary(summary_str, global_step=global_step)
+            self._writer.flush()
+        return path
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._sess.close()
+
+
+def _run_worker(conn, build_model, make_optimizer, shard_size, num_threads, log_dir):
+    # serves (command, args) messages until 'stop'. Every command but apply
+    # is answered with ('ok', result) or ('error', traceback).
+    try:
+        replica = _Replica(build_model, make_optimizer, shard_size, num_threads, log_dir)
+        conn.send(('ok', None))
+    except Exception:
+        conn.send(('error', traceback.format_exc()))
+        return
+    try:
+        while True:
+            command, args = conn.recv()
+            if command == 'stop':
+                break
+            try:
+                if command == 'apply':
+                    # not answered, the next command reports a failure
+                    replica.apply(*args)
+                    continue
+                result = getattr(replica, command)(*args)
+                conn.send(('ok', result))
+            except Exception:
+                conn.send(('error', traceback.format_exc()))
+    finally:
+        replica.close()
+        conn.close()
+
+
+def split_batch(batch, num_shards):
+    # splits every array of a batch tuple into num_shards equal shards along
+    # the first dim, so the averaged shard gradients equal the batch gradient
+    for array in batch:
+        if len(array) % num_shards != 0:
+            raise ValueError('a batch of {} does not split into {} equal shards'.format(len(array), num_shards))
+    return zip(*[np.split(np.asarray(array), num_shards) for array in batch])
+
+
+class DataParallelTrainer(object):
+    def __init__(self, build_model, make_optimizer, num_workers, shard_size,
+                 threads_per_worker=None, log_dir=None):
+        # build_model and make_optimizer run in the worker processes, which
+        # are forked, so they can be closures over the pipeline's settings.
+        # The cores are shared out between the workers unless
+        # threads_per_worker says otherwise.
+        self._num_workers = num_workers
+        if threads_per_worker is None:
+            threads_per_worker = max(1, multiprocessing.cpu_count() // num_workers)
+        self._conns = []
+        self._processes = []
+        for i in range(num_workers):
+            conn, worker_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_run_worker,
+                                              args=(worker_conn, build_model, make_optimizer, shard_size,
+                                                    threads_per_worker, log_dir if i == 0 else None))
+            process.daemon = True
+            process.start()
+            self._conns.append(conn)
+            self._processes.append(process)
+        self._gather()
+
+        # every replica starts from worker 0's initial weights
+        self._init_dir = tempfile.mkdtemp(prefix='data_parallel')
+        checkpoint = self._call(0, 'initialize', os.path.join(self._init_dir, 'init.ckpt'))
+        for conn in self._conns[1:]:
+            conn.send(('restore', (checkpoint,)))
+        self._gather(self._conns[1:])
+
+    @property
+    def num_workers(self):
+        return self._num_workers
+
+    def _receive(self, conn):
+        status, result = conn.recv()
+        if status == 'error':
+            raise RuntimeError('data parallel worker failed:\n' + result)
+        return result
+
+    def _gather(self, conns=None):
+        if conns is None:
+            conns = self._conns
+        return [self._receive(conn) for conn in conns]
+
+    def _call(self, worker, command, *args):
+        self._conns[worker].send((command, args))
+        return self._receive(self._conns[worker])
+
+    def step(self, shards):
+        # one synchronous update from one shard per worker, returns the loss
+        # averaged over the shards
+        if len(shards) != self._num_workers:
+            raise ValueError('{} shards for {} workers'.format(len(shards), self._num_workers))
+        for conn, shard in zip(self._conns, shards):
+            conn.send(('gradients', (shard,)))
+        losses, grads = zip(*self._gather())
+        mean_grads = [np.mean(worker_grads, axis=0) for worker_grads in zip(*grads)]
+        for conn in self._conns:
+            conn.send(('apply', (mean_grads,)))
+        return float(np.mean(losses))
+
+    def save(self, checkpoint, global_step, loss):
+        # checkpoint (and train_loss summary) of worker 0, all replicas hold
+        # the same weights
+        return self._call(0, 'save', checkpoint, global_step, loss)
+
+    def close(self):
+        for conn in self._conns:
+            conn.send(('stop', ()))
+        for process in self._processes:
+            process.join()
+        shutil.rmtree(self._init_dir, ignore_errors=True)
+
+
+def benchmark_scaling(make_trainer, next_shards, worker_counts=(1, 2, 4, 8), steps=50, warmup_steps=5):
+    # trains steps updates with every number of workers and reports the
+    # throughput. make_trainer(num_workers) returns a DataParallelTrainer,
+    # next_shards(num_workers) the shards of one update and the number of
+    # examples in them.
+    results = []
+    for num_workers in worker_counts:
+        trainer = make_trainer(num_workers)
+        try:
+            for _ in range(warmup_steps):
+                trainer.step(next_shards(num_workers)[0])
+            examples = 0
+            start = time.time()
+            for _ in range(steps):
+                shards, num_examples = next_shards(num_workers)
+                examples += num_examples
+                trainer.step(shards)
+            seconds = time.time() - start
+        finally:
+            trainer.close()
+        results.append({'workers': num_workers,
+                        'steps_per_second': steps / seconds,
+                        'examples_per_second': examples / seconds})
+    base = results[0]['examples_per_second']
+    for result in results:
+        result['speedup'] = result['examples_per_second'] / base
+        print ("{:2d} workers  {:8.2f} steps/s  {:9.1f} examples/s  {:5.2f}x".format(
+            result['workers'], result['steps_per_second'], result['examples_per_second'], result['speedup']))
+    return results
@@ -0,0 +1,79 @@
+import json
+import os
+
+import numpy as np
+
+# A dataset directory holds one plain .npy file per array and a manifest.json
+# with their shapes and dtypes plus metadata like provinces and
+# num_timesteps. Unlike np.save on a tuple nothing is pickled, and arrays can
+# be opened with mmap_mode='r', so only the pages a reader touches are read
+# and processes reading the same dataset share them.
+MANIFEST = 'manifest.json'
+FORMAT_VERSION = 1
+
+
+def is_dataset_dir(path):
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def find_dataset_dir(path):
+    # the dataset directory for path: path itself, or for a legacy
+    # foo.npy file a foo/ directory next to it
+    for candidate in [path, os.path.splitext(path)[0]]:
+        if is_dataset_dir(candidate):
+            return candidate
+    return None
+
+
+def save_dataset_dir(path, arrays, **metadata):
+    # arrays is a {name: array} dict, metadata has to be json serialisable
+    if not os.path.exists(path):
+        os.makedirs(path)
+    manifest = {'version': FORMAT_VERSION, 'arrays': {}}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        if array.dtype == object:
+            raise ValueError('{} is an object array, it would need pickling'.format(name))
+        filename = name + '.npy'
+        np.save(os.path.join(path, filename), array)
+        manifest['arrays'][name] = {'file': filename,
+                                    'shape': list(array.shape),
+                                    'dtype': array.dtype.str}
+    manifest.update(metadata)
+    with open(os.path.join(path, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    print ("saved dataset to {}".format(path))
+
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != FORMAT_VERSION:
+        raise ValueError('{} has dataset format version {}, expected {}'.format(
+            path, manifest.get('version'), FORMAT_VERSION))
+    return manifest
+
+
+def load_dataset_dir(path, names=None, mmap_mode='r'):
+    # returns ({name: array}, manifest) for the arrays in names (all of
+    # them by default), memory mapped read only unless mmap_mode is None
+    manifest = read_manifest(path)
+    arrays = {}
+    for name in names or manifest['arrays'].keys():
+        entry = manifest['arrays'][name]
+        array = np.load(os.path.join(path, entry['file']), mmap_mode=mmap_mode)
+        if list(array.shape) != entry['shape'] or array.dtype.str != entry['dtype']:
+            raise ValueError('{} in {} does not match the manifest'.format(name, path))
+        arrays[name] = array
+    return arrays, manifest
+
+
+def load_history(history_file):
+    # (data, provinces) of an extrapolation history: a dataset directory as
+    # preprocessing.create_data_for_extrapolation_aligned_by_time writes it,
+    # or a legacy pickled (data, provinces) .npy
+    dataset_dir = find_dataset_dir(history_file)
+    if dataset_dir is None:
+        return np.load(history_file)
+    arrays, manifest = load_dataset_dir(dataset_dir, ['data'])
+    return arrays['data'], manifest['provinces']
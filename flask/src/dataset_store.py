@@ -0,0 +1,71 @@
+import threading
+import numpy as np
+
+import dataset_format
+
+
+class HistoryDataset(object):
+    def __init__(self, history_file):
+        # history files are pickled (data, provinces) tuples or dataset
+        # directories, with data being [num_provinces x (num_timesteps, num_feats)]
+        data, provinces = dataset_format.load_history(history_file)
+        self._history_file = history_file
+        self._windows = np.ascontiguousarray(np.array([province_data for province_data in data],
+                                                      dtype=np.float32))
+        self._windows.setflags(write=False)
+        self._lat_lon = np.ascontiguousarray(self._windows[:, 0, 1:])
+        self._lat_lon.setflags(write=False)
+        self._provinces = [str(province) for province in provinces]
+        self._province_index = dict((province, i) for i, province in enumerate(self._provinces))
+
+    @property
+    def history_file(self):
+        return self._history_file
+
+    @property
+    def windows(self):
+        # [num_provinces, num_timesteps, num_feats] float32, read only
+        return self._windows
+
+    @property
+    def lat_lon(self):
+        # [num_provinces, 2] relative lat and lon of every province
+        return self._lat_lon
+
+    @property
+    def provinces(self):
+        return self._provinces
+
+    @property
+    def province_index(self):
+        return self._province_index
+
+    @property
+    def num_provinces(self):
+        return len(self._provinces)
+
+
+class DatasetStore(object):
+    def __init__(self):
+        self._datasets = {}
+        self._lock = threading.Lock()
+
+    def get(self, history_file):
+        # loads the history file on first use and keeps it resident
+        with self._lock:
+            if history_file not in self._datasets:
+                self._datasets[history_file] = HistoryDataset(history_file)
+            return self._datasets[history_file]
+
+    def reload(self, history_file=None):
+        # rereads one history file, or every resident one if none is given
+        with self._lock:
+            if history_file is None:
+                history_files = self._datasets.keys()
+            else:
+                history_files = [history_file]
+            for f in history_files:
+                self._datasets[f] = HistoryDataset(f)
+
+    def __contains__(self, history_file):
+        return history_file in self._datasets
@@ -0,0 +1,61 @@
+import threading
+
+from collections import OrderedDict
+
+
+def canonical_etc_key(etc_dict):
+    # the same placement can come in any key order and with explicit zeros,
+    # so key on the sorted (province, # of ETCs) pairs that actually add ETCs
+    if not etc_dict:
+        return ()
+    return tuple(sorted((province, num_etcs)
+                        for province, num_etcs in etc_dict.items() if num_etcs))
+
+
+class ForecastCache(object):
+    def __init__(self, max_entries=256):
+        self._entries = OrderedDict()
+        self._max_entries = max_entries
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self._misses += 1
+                return None
+            self._hits += 1
+            # move to the most recently used end
+            value = self._entries.pop(key)
+            self._entries[key] = value
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._entries:
+                self._entries.pop(key)
+            self._entries[key] = value
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'entries': len(self._entries),
+                'max_entries': self._max_entries,
+                'hits': self._hits,
+                'misses': self._misses}
@@ -0,0 +1,43 @@
+import json
+import struct
+import numpy as np
+
+# Packed forecast layout, all little endian:
+#   4s   magic 'NGAF'
+#   I    format version
+#   I    header length in bytes, padded so the values start 4 byte aligned
+#   ...  utf-8 json header {"provinces": [...], "series": [...], "num_steps": H}
+#   ...  float32 values, [num_provinces, num_series, num_steps]
+MIMETYPE = 'application/x-forecast-float32'
+MAGIC = 'NGAF'
+VERSION = 1
+SERIES = ['without_etcs', 'with_etcs']
+
+_prefix = struct.Struct('<4sII')
+
+
+def pack_forecasts(both_graphs):
+    # both_graphs maps province to [without_etcs, with_etcs] as returned by
+    # pipeline_global.extrapolate
+    provinces = sorted(both_graphs.keys())
+    values = np.array([both_graphs[province] for province in provinces], dtype='<f4')
+    if len(provinces) == 0:
+        values = np.zeros((0, len(SERIES), 0), dtype='<f4')
+    num_steps = values.shape[2]
+
+    header = json.dumps({'provinces': provinces, 'series': SERIES, 'num_steps': num_steps},
+                        separators=(',', ':')).encode('utf-8')
+    header += b' ' * (-(_prefix.size + len(header)) % 4)
+    return _prefix.pack(MAGIC, VERSION, len(header)) + header + values.tostring()
+
+
+def unpack_forecasts(data):
+    # inverse of pack_forecasts
+    magic, version, header_length = _prefix.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not a version {} packed forecast'.format(VERSION))
+    header = json.loads(data[_prefix.size:_prefix.size + header_length].decode('utf-8'))
+    values = np.frombuffer(data, dtype='<f4', offset=_prefix.size + header_length)
+    values = np.reshape(values, (len(header['provinces']), len(header['series']), header['num_steps']))
+    return dict((province, [series.tolist() for series in province_values])
+                for province, province_values in zip(header['provinces'], values))
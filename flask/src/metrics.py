@@ -0,0 +1,143 @@
+import threading
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+# set to False to turn every call in here into a no-op
+enabled = True
+
+# upper bounds in seconds, +Inf is implied
+default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+count_buckets = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+_lock = threading.Lock()
+_counters = defaultdict(float) # (name, labels) -> value
+_histograms = {} # (name, labels) -> [buckets, bucket counts, sum, count]
+_help = {
+    'forecast_requests_total': 'HTTP requests by endpoint and status',
+    'forecast_request_seconds': 'HTTP request latency',
+    'forecast_request_model_calls': 'model calls made to serve one request',
+    'forecast_stage_seconds': 'time spent per stage of serving a forecast',
+    'forecast_model_calls_total': 'session runs or numpy forward passes',
+}
+_request = threading.local()
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def describe(name, text):
+    _help[name] = text
+
+
+def inc(name, value=1, **labels):
+    if not enabled:
+        return
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] += value
+
+
+def observe(name, value, buckets=default_buckets, **labels):
+    if not enabled:
+        return
+    key = (name, _labels(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [buckets, [0] * len(buckets), 0.0, 0]
+        for i, bound in enumerate(histogram[0]):
+            if value <= bound:
+                histogram[1][i] += 1
+        histogram[2] += value
+        histogram[3] += 1
+
+
+@contextmanager
+def timer(name, **labels):
+    # observes how long the with block took in seconds
+    start = time.time()
+    try:
+        yield
+    finally:
+        observe(name, time.time() - start, **labels)
+
+
+def stage(name):
+    # time of one stage of serving a request, see forecast_stage_seconds
+    return timer('forecast_stage_seconds', stage=name)
+
+
+def start_request():
+    _request.model_calls = 0
+
+
+def count_model_call():
+    # model calls made while serving the current request, on this thread
+    inc('forecast_model_calls_total')
+    _request.model_calls = getattr(_request, 'model_calls', 0) + 1
+
+
+def request_model_calls():
+    return getattr(_request, 'model_calls', 0)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in labels) + '}'
+
+
+def _format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+def render(gauges=None):
+    # prometheus text format of every counter and histogram, plus gauges, a
+    # {name: value} or {name: [(labels dict, value)]} dict of current values
+    with _lock:
+        counters = dict(_counters)
+        histograms = dict((key, (h[0], list(h[1]), h[2], h[3])) for key, h in _histograms.items())
+
+    lines = []
+    def header(name, kind):
+        if name in _help:
+            lines.append('# HELP {} {}'.format(name, _help[name]))
+        lines.append('# TYPE {} {}'.format(name, kind))
+
+    for name in sorted(set(name for name, _ in counters)):
+        header(name, 'counter')
+        for (n, labels), value in sorted(counters.items()):
+            if n == name:
+                lines.append('{}{} {}'.format(name, _format_labels(labels), _format_value(value)))
+
+    for name in sorted(set(name for name, _ in histograms)):
+        header(name, 'histogram')
+        for (n, labels), (buckets, bucket_counts, total, count) in sorted(histograms.items()):
+            if n != name:
+                continue
+            for bound, bucket_count in zip(buckets, bucket_counts):
+                lines.append('{}_bucket{} {}'.format(name, _format_labels(labels + (('le', bound),)),
+                                                     bucket_count))
+            lines.append('{}_bucket{} {}'.format(name, _format_labels(labels + (('le', '+Inf'),)), count))
+            lines.append('{}_sum{} {}'.format(name, _format_labels(labels), _format_value(total)))
+            lines.append('{}_count{} {}'.format(name, _format_labels(labels), count))
+
+    for name, values in sorted((gauges or {}).items()):
+        header(name, 'gauge')
+        if not isinstance(values, list):
+            values = [({}, values)]
+        for labels, value in values:
+            lines.append('{}{} {}'.format(name, _format_labels(_labels(labels)), _format_value(value)))
+
+    return '\n'.join(lines) + '\n'
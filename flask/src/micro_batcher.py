@@ -0,0 +1,96 @@
+import threading
+import time
+
+
+class _Request(object):
+    def __init__(self, key, items):
+        self.key = key
+        self.items = items
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Failed(object):
+    # a result of run_batch for a request that failed on its own, its error
+    # is raised to that request only
+    def __init__(self, error):
+        self.error = error
+
+
+class MicroBatcher(object):
+    # Collects requests that arrive within max_wait seconds of the first one
+    # (up to max_items items in total), and hands each group of requests
+    # with the same key to run_batch(key, list of item lists) at once.
+    # run_batch returns one result (or Failed) per request, an exception it
+    # raises goes to every request of the group.
+    def __init__(self, run_batch, max_wait=0.005, max_items=32):
+        self._run_batch = run_batch
+        self._max_wait = max_wait
+        self._max_items = max_items
+        self._queue = []
+        self._condition = threading.Condition()
+        self._num_batches = 0
+        self._num_requests = 0
+
+        self._thread = threading.Thread(target=self._loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stats(self):
+        return {'batches': self._num_batches,
+                'requests': self._num_requests,
+                'max_wait': self._max_wait,
+                'max_items': self._max_items}
+
+    def submit(self, key, items):
+        request = _Request(key, items)
+        with self._condition:
+            self._queue.append(request)
+            self._condition.notify()
+        request.event.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._queue:
+                self._condition.wait()
+            deadline = time.time() + self._max_wait
+            while True:
+                num_items = sum(len(request.items) for request in self._queue)
+                remaining = deadline - time.time()
+                if num_items >= self._max_items or remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            # always take the first request, even if it is bigger than max_items
+            batch = [self._queue.pop(0)]
+            num_items = len(batch[0].items)
+            while self._queue and num_items + len(self._queue[0].items) <= self._max_items:
+                num_items += len(self._queue[0].items)
+                batch.append(self._queue.pop(0))
+            return batch
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            groups = {}
+            for request in batch:
+                groups.setdefault(request.key, []).append(request)
+            for key, requests in groups.items():
+                try:
+                    results = self._run_batch(key, [request.items for request in requests])
+                    for request, result in zip(requests, results):
+                        if isinstance(result, Failed):
+                            request.error = result.error
+                        else:
+                            request.result = result
+                except Exception as e:
+                    for request in requests:
+                        request.error = e
+                for request in requests:
+                    request.event.set()
+            self._num_batches += 1
+            self._num_requests += len(batch)
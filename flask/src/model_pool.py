@@ -0,0 +1,235 @@
+import importlib
+import multiprocessing
+import pickle
+import threading
+import time
+import traceback
+
+from Queue import Empty
+
+
+class WorkerUnavailable(Exception):
+    # a call that no worker answered in time, or whose worker died
+    pass
+
+
+def _worker_loop(worker_id, tasks, results, module_name, init_kwargs, current_task):
+    # every worker restores its own model, then runs functions of the
+    # pipeline module by name until it gets None. current_task is shared
+    # memory holding the id of the task being run (-1 when idle), which the
+    # pool still reads if the worker dies before its 'start' message is sent.
+    pipeline = importlib.import_module(module_name)
+    # a worker runs one task at a time, so a micro batcher in here would
+    # only ever see one request
+    pipeline.micro_batch_wait = 0
+    try:
+        pipeline.init_model(**init_kwargs)
+        pipeline.warm_up()
+    except Exception:
+        error = traceback.format_exc()
+        print (error)
+        results.put(('failed', worker_id, None, None, error, 0.0))
+        return
+    results.put(('ready', worker_id, None, None, None, 0.0))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, function_name, args, deadline = task
+        if time.time() > deadline:
+            # the caller got its 503 already, don't spend a worker on it
+            error = (WorkerUnavailable('the call waited in the queue for too long'), None)
+            results.put(('done', worker_id, task_id, None, error, 0.0))
+            continue
+        current_task.value = task_id
+        results.put(('start', worker_id, task_id, None, None, 0.0))
+        start_time = time.time()
+        result, error = None, None
+        try:
+            result = getattr(pipeline, function_name)(*args)
+        except Exception as e:
+            # the exception itself goes along when it pickles, so the caller
+            # can tell errors like an unknown dataset apart
+            try:
+                pickle.dumps(e)
+            except Exception:
+                e = None
+            error = (e, traceback.format_exc())
+        results.put(('done', worker_id, task_id, result, error, time.time() - start_time))
+        current_task.value = -1
+
+
+class _PendingCall(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.unavailable = False
+        self.started = False
+
+
+class ModelPool(object):
+    # call_timeout is how long a call may wait for its result, workers skip
+    # calls that waited in the queue for longer. Workers that die (segfault,
+    # oom kill) are restarted and their call fails right away.
+    # Exceptions of the passthrough_errors types are reraised by call as
+    # they are, all others as a RuntimeError with the worker's traceback.
+    def __init__(self, num_workers, module_name='pipeline_global', init_kwargs=None,
+                 call_timeout=60.0, check_interval=1.0, passthrough_errors=()):
+        self._passthrough_errors = passthrough_errors
+        self._module_name = module_name
+        self._init_kwargs = init_kwargs or {}
+        self._call_timeout = call_timeout
+        self._check_interval = check_interval
+        self._last_check = time.time()
+        self._closing = False
+        self._tasks = multiprocessing.Queue()
+        self._results = multiprocessing.Queue()
+        self._pending = {}
+        self._next_task_id = 0
+        self._num_queued = 0
+        self._lock = threading.Lock()
+        self._load_error = None
+        self._start_time = time.time()
+        self._worker_stats = [{'ready': False, 'failed': False, 'busy': False, 'tasks': 0,
+                               'busy_seconds': 0.0, 'task_id': None, 'restarts': 0}
+                              for _ in range(num_workers)]
+        self._current_tasks = [multiprocessing.RawValue('l', -1) for _ in range(num_workers)]
+
+        self._workers = [self._start_worker(worker_id) for worker_id in range(num_workers)]
+
+        self._dispatcher = threading.Thread(target=self._collect_results)
+        self._dispatcher.daemon = True
+        self._dispatcher.start()
+
+    @property
+    def num_workers(self):
+        return len(self._workers)
+
+    def _start_worker(self, worker_id):
+        self._current_tasks[worker_id].value = -1
+        worker = multiprocessing.Process(target=_worker_loop,
+                                         args=(worker_id, self._tasks, self._results,
+                                               self._module_name, self._init_kwargs,
+                                               self._current_tasks[worker_id]))
+        worker.daemon = True
+        worker.start()
+        return worker
+
+    def _check_workers(self):
+        # restarts workers that died, failing the call each one was running.
+        # Workers whose model failed to load exited on purpose and stay down.
+        with self._lock:
+            if self._closing:
+                return
+            for worker_id, worker in enumerate(self._workers):
+                stats = self._worker_stats[worker_id]
+                if worker.is_alive() or stats['failed']:
+                    continue
+                pending = self._pending.pop(self._current_tasks[worker_id].value, None)
+                if pending is not None:
+                    if not pending.started:
+                        # died before its 'start' message went out
+                        self._num_queued -= 1
+                    pending.unavailable = True
+                    pending.error = 'model worker {} died (exit code {})'.format(worker_id, worker.exitcode)
+                    pending.event.set()
+                stats.update(ready=False, busy=False, task_id=None)
+                stats['restarts'] += 1
+                self._workers[worker_id] = self._start_worker(worker_id)
+
+    def _collect_results(self):
+        while True:
+            if time.time() - self._last_check >= self._check_interval:
+                self._last_check = time.time()
+                self._check_workers()
+            try:
+                message = self._results.get(timeout=self._check_interval)
+            except Empty:
+                continue
+            if message is None:
+                break
+            kind, worker_id, task_id, result, error, seconds = message
+            with self._lock:
+                stats = self._worker_stats[worker_id]
+                if kind == 'ready':
+                    stats['ready'] = True
+                elif kind == 'failed':
+                    stats['failed'] = True
+                    self._load_error = error
+                elif kind == 'start':
+                    stats['busy'] = True
+                    stats['task_id'] = task_id
+                    # calls that timed out in the queue are no longer counted
+                    if task_id in self._pending:
+                        self._pending[task_id].started = True
+                        self._num_queued -= 1
+                elif kind == 'done':
+                    stats['busy'] = False
+                    stats['task_id'] = None
+                    stats['tasks'] += 1
+                    stats['busy_seconds'] += seconds
+                    pending = self._pending.pop(task_id, None)
+                    if pending is not None:
+                        if not pending.started:
+                            # skipped by the worker, its caller is timing out
+                            self._num_queued -= 1
+                        pending.result = result
+                        pending.error = error
+                        pending.event.set()
+
+    def is_ready(self):
+        # every worker has restored and warmed up its model
+        with self._lock:
+            return all(stats['ready'] for stats in self._worker_stats)
+
+    def load_error(self):
+        return self._load_error
+
+    def call(self, function_name, *args):
+        # runs <function_name>(*args) of the pipeline module on the next free worker
+        pending = _PendingCall()
+        with self._lock:
+            task_id = self._next_task_id
+            self._next_task_id += 1
+            self._pending[task_id] = pending
+            self._num_queued += 1
+        self._tasks.put((task_id, function_name, args, time.time() + self._call_timeout))
+        if not pending.event.wait(self._call_timeout):
+            with self._lock:
+                if self._pending.pop(task_id, None) is not None and not pending.started:
+                    self._num_queued -= 1
+            if not pending.event.is_set():
+                raise WorkerUnavailable('no model worker answered within {}s'.format(self._call_timeout))
+        if pending.unavailable:
+            raise WorkerUnavailable(pending.error)
+        if pending.error is not None:
+            exception, trace = pending.error
+            if isinstance(exception, (WorkerUnavailable,) + self._passthrough_errors):
+                raise exception
+            raise RuntimeError('model worker failed:\n' + trace)
+        return pending.result
+
+    def stats(self):
+        with self._lock:
+            uptime = time.time() - self._start_time
+            workers = []
+            for worker_id, stats in enumerate(self._worker_stats):
+                worker = dict(stats)
+                worker['id'] = worker_id
+                worker['utilisation'] = stats['busy_seconds'] / uptime if uptime > 0 else 0.0
+                workers.append(worker)
+            return {'num_workers': len(self._workers),
+                    'queue_depth': self._num_queued,
+                    'in_flight': len(self._pending),
+                    'workers': workers}
+
+    def close(self):
+        with self._lock:
+            self._closing = True
+        for _ in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._results.put(None)
@@ -0,0 +1,205 @@
+import glob
+import os
+import threading
+
+import profiling
+
+from collections import OrderedDict
+
+
+def _checkpoint_nbytes(model_path):
+    # size of a checkpoint on disk, a V1 file or the .index and .data-*
+    # files of a V2 checkpoint
+    if os.path.isfile(model_path):
+        return os.path.getsize(model_path)
+    paths = glob.glob(model_path + '.index') + glob.glob(model_path + '.data-*')
+    if not paths:
+        raise IOError('no checkpoint at {}'.format(model_path))
+    return sum(os.path.getsize(path) for path in paths)
+
+
+class TFPredictor(object):
+    # restored checkpoint in its own graph and session, so the models of
+    # several datasets can be loaded side by side
+    def __init__(self, model_path, batch_size, num_timesteps=25, num_feats=3, horizon=1, hidden_size=128):
+        import tensorflow as tf
+        import models
+
+        self._batch_size = batch_size
+        self._horizon = horizon
+        self._graph = tf.Graph()
+        with self._graph.as_default():
+            self._input_tensor, self._pred, _ = models.import_model(num_timesteps,
+                                                                    num_feats,
+                                                                    batch_size,
+                                                                    horizon,
+                                                                    hidden_size)
+            saver = tf.train.Saver()
+            self._sess = tf.Session(graph=self._graph,
+                                    config=tf.ConfigProto(allow_soft_placement=True))
+            saver.restore(self._sess, model_path)
+        self._nbytes = _checkpoint_nbytes(model_path)
+
+    @property
+    def session(self):
+        return self._sess
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    @property
+    def horizon(self):
+        return self._horizon
+
+    def predict_horizon(self, windows):
+        import numpy as np
+
+        # windows is [num_windows, num_timesteps, num_feats]. The graph is built
+        # for batch_size rows, so pad the last chunk with zeros; the rows of
+        # the lstm don't interact, so padding never changes the real outputs.
+        num_windows = windows.shape[0]
+        preds = np.zeros((num_windows, self._horizon), dtype=np.float32)
+        for start in range(0, num_windows, self._batch_size):
+            chunk = windows[start:start + self._batch_size]
+            num_rows = chunk.shape[0]
+            if num_rows < self._batch_size:
+                padding = np.zeros((self._batch_size - num_rows,) + chunk.shape[1:],
+                                   dtype=chunk.dtype)
+                chunk = np.concatenate((chunk, padding), axis=0)
+            pred_values = profiling.run(self._sess, self._pred, {self._input_tensor: chunk})
+            preds[start:start + num_rows] = pred_values[:num_rows]
+        return preds
+
+    def predict(self, windows):
+        return self.predict_horizon(windows)[:, 0]
+
+    def close(self):
+        self._sess.close()
+
+
+class ServingModel(object):
+    # everything /api/charts needs for one dataset: the model, the resident
+    # history and the province geometry
+    def __init__(self, name, model_path, predictor, dataset, provinces):
+        self.name = name
+        self.model_path = model_path
+        self.predictor = predictor
+        self.dataset = dataset
+        self.provinces = provinces
+
+    @property
+    def history_file(self):
+        return self.dataset.history_file
+
+    @property
+    def nbytes(self):
+        return self.predictor.nbytes + self.dataset.windows.nbytes + self.provinces.nbytes
+
+    @property
+    def horizon(self):
+        return self.predictor.horizon
+
+    @property
+    def stateful(self):
+        # whether the predictor can step its lstm state one sample at a time
+        return hasattr(self.predictor, 'step')
+
+    def predict(self, windows):
+        return self.predictor.predict(windows)
+
+    def predict_horizon(self, windows):
+        return self.predictor.predict_horizon(windows)
+
+    def start(self, windows):
+        return self.predictor.start(windows)
+
+    def step(self, samples, state):
+        return self.predictor.step(samples, state)
+
+    def close(self):
+        if hasattr(self.predictor, 'close'):
+            self.predictor.close()
+
+
+class ModelRegistry(object):
+    # Loads serving models by dataset name on first use with
+    # load_model(name), and evicts the least recently used idle ones when
+    # the loaded models need more than memory_budget bytes.
+    def __init__(self, load_model, memory_budget):
+        self._load_model = load_model
+        self._memory_budget = memory_budget
+        self._models = OrderedDict()
+        self._in_use = {}
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._num_loads = 0
+        self._num_evictions = 0
+
+    def _touch(self, name):
+        # move to the most recently used end
+        self._models[name] = self._models.pop(name)
+
+    def get(self, name):
+        with self._lock:
+            if name in self._models:
+                self._touch(name)
+                return self._models[name]
+
+        # loads are slow, don't hold up requests for models that are loaded
+        with self._load_lock:
+            with self._lock:
+                if name in self._models:
+                    self._touch(name)
+                    return self._models[name]
+            model = self._load_model(name)
+            with self._lock:
+                self._models[name] = model
+                self._num_loads += 1
+                self._evict(keep=name)
+            return model
+
+    def acquire(self, name):
+        # like get, but the model isn't evicted until it is released
+        with self._lock:
+            self._in_use[name] = self._in_use.get(name, 0) + 1
+        try:
+            return self.get(name)
+        except Exception:
+            self.release(name)
+            raise
+
+    def release(self, name):
+        with self._lock:
+            self._in_use[name] -= 1
+            if self._in_use[name] == 0:
+                del self._in_use[name]
+
+    def _evict(self, keep):
+        total = sum(model.nbytes for model in self._models.values())
+        for name in list(self._models.keys()):
+            if total <= self._memory_budget:
+                break
+            if name == keep or name in self._in_use:
+                continue
+            model = self._models.pop(name)
+            total -= model.nbytes
+            model.close()
+            self._num_evictions += 1
+
+    def loaded(self):
+        with self._lock:
+            return self._models.values()
+
+    def clear(self):
+        with self._lock:
+            for model in self._models.values():
+                model.close()
+            self._models.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'loaded': [(name, model.nbytes) for name, model in self._models.items()],
+                    'memory_budget': self._memory_budget,
+                    'loads': self._num_loads,
+                    'evictions': self._num_evictions}
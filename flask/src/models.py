@@ -2,30 +2,43 @@ import tensorflow as tf
 import prettytensor as pt
 import numpy as np
 
-def import_model(_num_timesteps, _len_feats, _batch_size):
+def import_model(_num_timesteps, _len_feats, _batch_size, _horizon=1, _hidden_size=128):
+    # _horizon > 1 predicts the next _horizon values at once instead of
+    # only the next one. _hidden_size is the number of lstm units.
     global num_timesteps
     global len_feats
     global batch_size
+    global horizon
+    global hidden_size
     num_timesteps = _num_timesteps
     len_feats = _len_feats
     batch_size = _batch_size
+    horizon = _horizon
+    hidden_size = _hidden_size
     return network()
 
 def fc_layers(input_tensor):
     return (pt.wrap(input_tensor).
             fully_connected(100, name='fc1').
-            fully_connected(1, name='fc2')).tensor
+            fully_connected(horizon, name='fc2')).tensor
 
 def rnn(rnn_inputs):
-    return (pt.wrap(rnn_inputs).
+    # rnn_inputs is [batch_size, num_timesteps, len_feats]. cleave_sequence
+    # splits the first dim into num_timesteps chunks, so go time major first.
+    time_major = tf.reshape(tf.transpose(rnn_inputs, [1, 0, 2]),
+                            [num_timesteps * batch_size, len_feats])
+    return (pt.wrap(time_major).
             cleave_sequence(num_timesteps).
-            sequence_lstm(128).
-            squash_sequence())[num_timesteps - 1,:]
+            sequence_lstm(hidden_size).
+            squash_sequence())[(num_timesteps - 1) * batch_size:, :]
 
 def network(): 
-    gt = tf.placeholder(tf.float32, 1)
+    if horizon == 1:
+        gt = tf.placeholder(tf.float32, [batch_size])
+    else:
+        gt = tf.placeholder(tf.float32, [batch_size, horizon])
     input_tensor = tf.placeholder(tf.float32,
-                                  [num_timesteps, len_feats])
+                                  [batch_size, num_timesteps, len_feats])
 
     assert(num_timesteps > 1)
     with tf.variable_scope("model") as scope:
@@ -0,0 +1,155 @@
+import numpy as np
+
+# checkpoint variable for every weight the numpy model needs, see
+# models.network. The lstm is prettytensor's sequence_lstm with peepholes.
+checkpoint_variables = {
+    'lstm_input_weights': 'model/sequence_lstm/fully_connected/weights',
+    'lstm_bias': 'model/sequence_lstm/fully_connected/bias',
+    'lstm_hidden_weights': 'model/sequence_lstm/fully_connected_1/weights',
+    'lstm_input_peephole': 'model/sequence_lstm/diagonal_matrix_mul/weights',
+    'lstm_forget_peephole': 'model/sequence_lstm/diagonal_matrix_mul_1/weights',
+    'lstm_output_peephole': 'model/sequence_lstm/diagonal_matrix_mul_2/weights',
+    'fc1_weights': 'fc1/weights',
+    'fc1_bias': 'fc1/bias',
+    'fc2_weights': 'fc2/weights',
+    'fc2_bias': 'fc2/bias',
+}
+
+# prettytensor adds 1 to the forget gate whenever the lstm has a bias
+forget_bias = 1.0
+
+
+def export_weights(sess, export_path):
+    # dumps the weights of the model in sess to a .npz. models.network has
+    # no batch normalized layers (the defaults scope only covers the lstm,
+    # which ignores batch_normalize), so there is nothing to fold; refuse
+    # checkpoints that do have moving averages rather than drop them.
+    import tensorflow as tf
+
+    with sess.graph.as_default():
+        variables = dict((v.op.name, v) for v in tf.all_variables())
+    batch_norm = [name for name in variables if 'moving' in name.lower()]
+    if batch_norm:
+        raise ValueError('cannot export batch normalized variables: {}'.format(batch_norm))
+
+    names = checkpoint_variables.keys()
+    values = sess.run([variables[checkpoint_variables[name]] for name in names])
+    weights = dict((name, np.asarray(value, dtype=np.float32))
+                   for name, value in zip(names, values))
+    np.savez(export_path, **weights)
+    print ("exported weights to {}".format(export_path))
+
+
+def _sigmoid(x):
+    # tanh form of the logistic function, does not overflow for large |x|
+    return 0.5 * (np.tanh(0.5 * x) + 1)
+
+
+class NumpyLSTMModel(object):
+    def __init__(self, weights):
+        for name in checkpoint_variables:
+            if name not in weights:
+                raise KeyError('missing weight {}'.format(name))
+        self._weights = dict((name, np.ascontiguousarray(weights[name], dtype=np.float32))
+                             for name in checkpoint_variables)
+        self._num_units = self._weights['lstm_hidden_weights'].shape[0]
+
+    @classmethod
+    def load(cls, export_path):
+        with np.load(export_path) as weights:
+            return cls(dict(weights.items()))
+
+    @classmethod
+    def random(cls, num_feats=3, num_units=128, num_hidden=100, horizon=1, seed=0):
+        # randomly initialised weights with the shapes of models.network
+        rng = np.random.RandomState(seed)
+        shapes = {
+            'lstm_input_weights': (num_feats, 4 * num_units),
+            'lstm_bias': (4 * num_units,),
+            'lstm_hidden_weights': (num_units, 4 * num_units),
+            'lstm_input_peephole': (num_units,),
+            'lstm_forget_peephole': (num_units,),
+            'lstm_output_peephole': (num_units,),
+            'fc1_weights': (num_units, num_hidden),
+            'fc1_bias': (num_hidden,),
+            'fc2_weights': (num_hidden, horizon),
+            'fc2_bias': (horizon,),
+        }
+        return cls(dict((name, rng.normal(scale=0.1, size=shape))
+                        for name, shape in shapes.items()))
+
+    @property
+    def weights(self):
+        return self._weights
+
+    @property
+    def nbytes(self):
+        return sum(weight.nbytes for weight in self._weights.values())
+
+    @property
+    def num_units(self):
+        return self._num_units
+
+    @property
+    def horizon(self):
+        # number of future values one forward pass predicts
+        return self._weights['fc2_weights'].shape[1]
+
+    def lstm_step(self, input_proj, c, h):
+        # one lstm timestep given the already projected input (x W + b)
+        w = self._weights
+        activation = input_proj + np.dot(h, w['lstm_hidden_weights'])
+        i, j, f, o = np.split(activation, 4, axis=1)
+        f = f + forget_bias
+        i = i + c * w['lstm_input_peephole']
+        f = f + c * w['lstm_forget_peephole']
+        new_c = c * _sigmoid(f) + _sigmoid(i) * np.tanh(j)
+        o = o + new_c * w['lstm_output_peephole']
+        new_h = np.tanh(new_c) * _sigmoid(o)
+        return new_c, new_h
+
+    def project_inputs(self, windows):
+        # input part of every lstm timestep at once, [batch, time, 4 * units]
+        w = self._weights
+        batch_size, num_timesteps, num_feats = windows.shape
+        proj = np.dot(np.reshape(windows, (batch_size * num_timesteps, num_feats)),
+                      w['lstm_input_weights']) + w['lstm_bias']
+        return np.reshape(proj, (batch_size, num_timesteps, -1))
+
+    def head(self, h):
+        # fc1 -> fc2 on the last lstm output, [batch, horizon]
+        w = self._weights
+        hidden = np.dot(h, w['fc1_weights']) + w['fc1_bias']
+        return np.dot(hidden, w['fc2_weights']) + w['fc2_bias']
+
+    def read_windows(self, windows):
+        # (c, h) lstm state after reading whole windows from a zero state
+        windows = np.asarray(windows, dtype=np.float32)
+        proj = self.project_inputs(windows)
+        c = np.zeros((windows.shape[0], self._num_units), dtype=np.float32)
+        h = np.zeros_like(c)
+        for t in range(windows.shape[1]):
+            c, h = self.lstm_step(proj[:, t, :], c, h)
+        return c, h
+
+    def start(self, windows):
+        # predict, but also returns the lstm state to step on from
+        c, h = self.read_windows(windows)
+        return self.head(h)[:, 0], (c, h)
+
+    def step(self, samples, state):
+        # feeds one new [batch, num_feats] sample into the state returned by
+        # start or step, one lstm timestep instead of a whole window
+        w = self._weights
+        samples = np.asarray(samples, dtype=np.float32)
+        c, h = self.lstm_step(np.dot(samples, w['lstm_input_weights']) + w['lstm_bias'], *state)
+        return self.head(h)[:, 0], (c, h)
+
+    def predict_horizon(self, windows):
+        # windows is [batch, num_timesteps, num_feats], returns [batch, horizon]
+        _, h = self.read_windows(windows)
+        return self.head(h)
+
+    def predict(self, windows):
+        # windows is [batch, num_timesteps, num_feats], returns [batch]
+        return self.predict_horizon(windows)[:, 0]
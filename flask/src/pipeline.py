@@ -7,6 +7,9 @@ import models
 import sys
 import os
 import data_loader
+import dataset_format
+import prefetcher
+import profiling
 
 from collections import defaultdict
 
@@ -19,20 +22,26 @@ tf.set_random_seed(0)
 
 parser = argparse.ArgumentParser(description='Epidemic Response System')
 parser.add_argument('-wd', '--working_directory', help='directory for storing logs')
-parser.add_argument('-sf', '--save_frequency', help='Number of epochs before saving')
+parser.add_argument('-sf', '--save_frequency', type=int, help='Number of epochs before saving')
 parser.add_argument('--model_path', help='Stored model path')
+parser.add_argument('--prefetch', type=int, default=0,
+                    help='batches to prepare ahead of training on a background thread')
+parser.add_argument('--batch_size', '--batch-size', type=int, default=1, help='sequences per training step')
+parser.add_argument('--profile', action='store_true',
+                    help='write a cProfile hotspot report and a chrome trace of the run')
+parser.add_argument('--profile_dir', default='profile/', help='where --profile writes to')
 parser.add_argument('mode', choices=('train', 'eval', 'extrapolate', 'etc_user'), help='train or eval')
 args = parser.parse_args()
 
 # Training Constants
 learning_rate = 1e-4
-batch_size = 1
+batch_size = args.batch_size
 num_timesteps = 25
 num_feats = 3
 max_epoch = 601
+prefetch_batches = args.prefetch
+shuffle_seed = 1234
 num_extrapolate = 20
-dataset_size = 3069
-updates_per_epoch = int(np.ceil(float(dataset_size) / float(batch_size)))
 
 if args.working_directory:
     working_directory = args.working_directory
@@ -48,8 +57,7 @@ else:
     model_path = 'trial/checkpoints/model.ckpt-600'
 
 def get_loss(pred, gt):
-    return tf.div(tf.reduce_mean(tf.square(tf.sub(gt, pred))),
-                  tf.constant(float(batch_size)))
+    return tf.reduce_mean(tf.square(tf.sub(gt, tf.reshape(pred, [-1]))))
 
 def train():
     with tf.device('/gpu:0'): # run on specific device
@@ -60,7 +68,11 @@ def train():
         optimizer = tf.train.AdamOptimizer(learning_rate, epsilon=1.0)
         train = optimizer.minimize(loss=loss)
 
-    dataset = data_loader.read_datasets(PREPROCESSED_DATA)
+    dataset = data_loader.read_datasets(PREPROCESSED_DATA, seed=shuffle_seed)
+    if prefetch_batches > 0:
+        # shuffles and slices the next batches while the session runs
+        dataset = prefetcher.PrefetchingDataSet(dataset, batch_size, prefetch_batches)
+    updates_per_epoch = dataset.num_examples // batch_size
     saver = tf.train.Saver()  # defaults to saving all variables
 
     # logging the loss function
@@ -84,10 +96,11 @@ def train():
             pbar.start()
             for i in range(updates_per_epoch):
                 pbar.update(i)
-                input_batch, gt_batch = dataset.next_batch(batch_size)
-                _, loss_value = sess.run([train, loss],
-                                         {input_tensor : input_batch,
-                                          gt : [gt_batch]})
+                with profiling.span('next_batch'):
+                    input_batch, gt_batch = dataset.next_batch(batch_size)
+                _, loss_value = profiling.run(sess, [train, loss],
+                                                    {input_tensor : input_batch,
+                                                     gt : gt_batch})
                 training_loss += np.sum(loss_value)
 
             training_loss = training_loss/(updates_per_epoch)
@@ -104,10 +117,12 @@ def train():
                 # save summaries
                 summary_str = sess.run(merged,
                               feed_dict={input_tensor : input_batch,
-                                         gt : [gt_batch],
+                                         gt : gt_batch,
                                          loss_placeholder: training_loss})
                 writer.add_summary(summary_str, global_step=epoch)
         writer.close()
+    if prefetch_batches > 0:
+        dataset.close()
 
 def evaluate(print_grid=False):
     with tf.device('/gpu:0'): # run on specific device
@@ -115,30 +130,34 @@ def evaluate(print_grid=False):
                                                      num_feats,
                                                      batch_size)
 
-    dataset = data_loader.read_datasets(PREPROCESSED_DATA, dataset_type='test')
+    dataset = data_loader.read_datasets(PREPROCESSED_DATA, dataset_type='test',
+                                        partial_last_batch=True)
 
     saver = tf.train.Saver()
 
     with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as sess:
         saver.restore(sess, model_path)
 
+        # every test example is scored, the last batch is zero padded up to
+        # batch_size and only its real rows are kept
         all_pred, all_gt = [], []
-        for i in range(updates_per_epoch):
-            input_batch, gt_batch = dataset.next_batch(batch_size)
-            pred_value = sess.run([pred],
-                                  {input_tensor : input_batch,
-                                   gt : [gt_batch]})
+        for i in range(-(-dataset.num_examples // batch_size)):
+            with profiling.span('next_batch'):
+                input_batch, gt_batch = dataset.next_batch(batch_size)
+            num_rows = len(gt_batch)
+            padded_gt = data_loader.pad_batch(gt_batch, batch_size)
+            pred_value = profiling.run(sess, pred,
+                                       {input_tensor : data_loader.pad_batch(input_batch, batch_size),
+                                        gt : padded_gt})
 
-            all_pred.append(pred_value)
+            all_pred.append(np.reshape(pred_value, np.shape(padded_gt))[:num_rows])
             all_gt.append(gt_batch)
 
-        num_align = 0
-        rmse = []
-        for i in range(len(all_pred)):
-            if all_pred[i] == all_gt[i]: num_align += 1
-            rmse.append(np.sqrt(np.power((all_pred[i] - all_gt[i]), 2)))
+        all_pred = np.concatenate(all_pred)
+        all_gt = np.concatenate(all_gt)
+        rmse = np.sqrt(np.power((all_pred - all_gt), 2))
 
-        print "Accuracy:", float(num_align)/len(all_pred)
+        print "Accuracy:", np.mean(all_pred == all_gt)
         print "Avg. RMSE", np.mean(rmse)
         print "Variance RMSE", np.var(rmse)
 
@@ -147,12 +166,13 @@ def evaluate(print_grid=False):
 def extrapolate(history_file, etc_dict=None):
     # etc_dict is a dict mapping from province to # of new ETCs there
     with tf.device('/gpu:0'):  # run on specific device
+        # one province window at a time
         input_tensor, pred, gt = models.import_model(num_timesteps,
                                                      num_feats,
-                                                     batch_size)
+                                                     1)
 
     # dataset should be [num_provinces x (num_timesteps, num_feats)]
-    data, provinces = np.load(history_file)
+    data, provinces = dataset_format.load_history(history_file)
 
     saver = tf.train.Saver()
 
@@ -169,8 +189,8 @@ def extrapolate(history_file, etc_dict=None):
             new_values = []
             old_value = province_data[-1, 0]
             for t in range(num_extrapolate):
-                pred_value = sess.run([pred],
-                                      {input_tensor: province_data})[0][0][0]
+                pred_value = profiling.run(sess, [pred],
+                                                 {input_tensor: [province_data]})[0][0][0]
                 if pred_value < 0:
                     pred_value = 0
                 extrapolated.append(pred_value)
@@ -203,6 +223,8 @@ def extrapolate(history_file, etc_dict=None):
 
 
 if __name__ == "__main__":
+    if args.profile:
+        profiling.start(args.profile_dir, args.mode)
     if args.mode == 'train':
         train()
     elif args.mode == 'eval':
@@ -1,31 +1,52 @@
-import tensorflow as tf
-import prettytensor as pt
 import numpy as np
 import scipy.io as io
 import argparse
-import models
+import contextlib
+import fractions
 import sys
 import os
+import threading
+import time
+import traceback
 import data_loader
+import data_parallel
+import dataset_format
+import dataset_store
+import forecast_cache
+import metrics
+import micro_batcher
+import model_registry
+import numpy_models
 import pickle
+import prefetcher
+import profiling
+import province_registry
 import numpy as np
 
-from collections import defaultdict
+try:
+    import tensorflow as tf
+    import prettytensor as pt
+    import models
+except ImportError:
+    # serving from an exported numpy model works without tensorflow
+    tf = None
 
 from constants import *
 from progressbar import ETA, Bar, Percentage, ProgressBar
 from sklearn.metrics import precision_recall_curve, average_precision_score
 # from preprocessing import get_lat_lon_map
 
-_saver = None
-_sess = None
-_input_tensor = None
-_pred = None
-_gt = None
+_forecast_cache = None
+_dataset_store = dataset_store.DatasetStore()
+_model_registry = None
+_micro_batcher = None
+_model_ready = threading.Event()
+_model_load_error = None
 
 
 np.random.seed(1234)
-tf.set_random_seed(0)
+if tf is not None:
+    tf.set_random_seed(0)
 
 # Training Constants
 learning_rate = 1e-4
@@ -33,26 +54,106 @@ batch_size = 1
 num_timesteps = 25
 num_feats = 3
 max_epoch = 601
+hidden_size = 128 # lstm units
 num_extrapolate = 20
-dataset_size = 3069
-updates_per_epoch = int(np.ceil(float(dataset_size) / float(batch_size)))
+working_directory = 'trial/'
+save_frequency = 10 # epochs between checkpoints
+prefetch_batches = 0 # batches prepared ahead on a background thread, 0 disables
+shuffle_seed = 1234
+training_dataset = 'guinea' # preprocessed dataset other window lengths and horizons train on
+num_workers = 1 # > 1 trains data parallel over that many processes, see data_parallel
+session_threads = 0 # threads per training session, 0 lets tensorflow use every core
+
+# Serving Constants
+serving_batch_size = 64 # windows per model call during extrapolation
+forecast_cache_size = 256 # etc placements kept by the forecast cache
+stream_chunk_size = 8 # provinces rolled out together when streaming
+serving_backend = 'auto' # 'numpy', 'tensorflow', or 'auto' for numpy when exported
+num_model_workers = 0 # > 0 serves /api/charts from a pool of worker processes
+model_call_timeout = 60.0 # seconds a pool call may take before the request fails with 503
+micro_batch_wait = 0.0 # seconds to collect concurrent requests into one rollout, 0 disables
+micro_batch_max_scenarios = 32 # cap on the scenarios rolled out together
+model_memory_budget = 256 * 1024 * 1024 # bytes of idle models kept loaded
+# 'window' reruns the lstm over the shifted 25 step window for every new
+# value, like training. 'stateful' steps the lstm state forward by the new
+# sample only, see compare_rollout_modes. tensorflow models always use 'window'.
+# Models trained with horizon >= num_extrapolate always run 'direct'.
+rollout_mode = 'window'
+horizon = 1 # values the model predicts per forward pass, see models.import_model
+ensemble_size = 16 # members of the monte carlo ensemble behind /api/bands
+ensemble_noise = 0.1 # relative std of the noise on the case counts of every member
+ensemble_quantiles = (0.1, 0.5, 0.9)
+ensemble_seed = 0
+# every optimize round rolls out beam_width x provinces scenarios, these cap
+# what one request can ask for
+optimize_max_budget = 10
+optimize_max_beam_width = 8
+optimize_max_top_k = 10
+
+# dataset name -> history file /api/charts extrapolates from. The lat/lon map
+# of a dataset is rel_lat_lon_map_<name>.pickle. Only datasets whose history
+# file and checkpoint both exist are served, see is_serving_dataset.
+default_dataset = 'guinea'
+serving_history_files = {
+    'guinea': PREPROCESSED_GUINEA_DATA_EXTRA,
+    'liberia': PREPROCESSED_LIBERIA_DATA_EXTRA,
+    'sierra': PREPROCESSED_SIERRA_DATA_EXTRA,
+    'all_three_countries': PREPROCESSED_ALL_THREE_COUNTRIES_DATA_EXTRA,
+}
+# dataset name -> checkpoint. default_dataset uses model_path, other
+# datasets need their own checkpoint in here to be served.
+serving_model_paths = {}
 
 model_path = '/Users/lisa1010/dev/nga_hacks/flask/src/good_checkpoints/model.ckpt-50'
 
 def get_loss(pred, gt):
-    return tf.div(tf.reduce_mean(tf.square(tf.sub(gt, pred))),
-                  tf.constant(float(batch_size)))
+    # works for horizon 1 ([batch] labels) and [batch, horizon] labels, and
+    # for the shards of data parallel training
+    return tf.reduce_mean(tf.square(tf.sub(tf.reshape(gt, [-1]),
+                                           tf.reshape(pred, [-1]))))
+
+
+def get_preprocessed_data_path(config=None):
+    # PREPROCESSED_DATA holds 25 step windows labelled with the next value.
+    # Other shapes train on the dataset directory
+    # preprocessing.convert_clean_csv_to_numpy_for_rnn writes for
+    # training_dataset, num_timesteps and horizon. config overrides
+    # num_timesteps and horizon like in run_trial.
+    config = config or {}
+    timesteps = config.get('num_timesteps', num_timesteps)
+    label_horizon = config.get('horizon', horizon)
+    if timesteps == 25 and label_horizon == 1:
+        return PREPROCESSED_DATA
+    suffix = "" if label_horizon == 1 else "_h" + str(label_horizon)
+    return PREPROCESSED_DIR + training_dataset + "_" + str(timesteps) + suffix
+
+
+def has_preprocessed_data(config=None):
+    path = get_preprocessed_data_path(config)
+    return os.path.exists(path) or dataset_format.find_dataset_dir(path) is not None
+
+
+def _session_config():
+    return tf.ConfigProto(allow_soft_placement=True,
+                          intra_op_parallelism_threads=session_threads,
+                          inter_op_parallelism_threads=session_threads)
 
 def train():
+    if num_workers > 1:
+        return train_data_parallel()
+
     with tf.device('/gpu:0'): # run on specific device
         input_tensor, pred, gt = models.import_model(num_timesteps,
                                                      num_feats,
-                                                     batch_size)
+                                                     batch_size,
+                                                     horizon,
+                                                     hidden_size)
         loss = get_loss(pred, gt)
         optimizer = tf.train.AdamOptimizer(learning_rate, epsilon=1.0)
         train = optimizer.minimize(loss=loss)
 
-    dataset = data_loader.read_datasets(PREPROCESSED_DATA)
+    dataset = _read_training_data()
+    updates_per_epoch = dataset.num_examples // batch_size
     saver = tf.train.Saver()  # defaults to saving all variables
 
     # logging the loss function
@@ -63,7 +164,7 @@ def train():
 
     init = tf.initialize_all_variables()
 
-    with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as sess:
+    with tf.Session(config=_session_config()) as sess:
         writer = tf.train.SummaryWriter(os.path.join(working_directory, 'logs'),
                 sess.graph_def)
         sess.run(init)
@@ -76,17 +177,18 @@ def train():
             pbar.start()
             for i in range(updates_per_epoch):
                 pbar.update(i)
-                input_batch, gt_batch = dataset.next_batch(batch_size)
-                _, loss_value = sess.run([train, loss],
-                                         {input_tensor : input_batch,
-                                          gt : [gt_batch]})
+                with profiling.span('next_batch'):
+                    input_batch, gt_batch = dataset.next_batch(batch_size)
+                _, loss_value = profiling.run(sess, [train, loss],
+                                                    {input_tensor : input_batch,
+                                                     gt : gt_batch})
                 training_loss += np.sum(loss_value)
 
             training_loss = training_loss/(updates_per_epoch)
             print("Loss %f" % training_loss)
 
-            # save model
-            if epoch % save_frequency == 0:
+            # save model, always after the last epoch
+            if epoch % save_frequency == 0 or epoch == max_epoch - 1:
                 checkpoints_folder = os.path.join(working_directory, 'checkpoints')
                 if not os.path.exists(checkpoints_folder):
                     os.makedirs(checkpoints_folder)
@@ -96,69 +198,350 @@ def train():
                 # save summaries
                 summary_str = sess.run(merged,
                               feed_dict={input_tensor : input_batch,
-                                         gt : [gt_batch],
+                                         gt : gt_batch,
                                          loss_placeholder: training_loss})
                 writer.add_summary(summary_str, global_step=epoch)
         writer.close()
+    if prefetch_batches > 0:
+        dataset.close()
+    return training_loss
+
+def _build_training_model(shard_size):
+    # the graph of one data parallel worker
+    tf.set_random_seed(0)
+    input_tensor, pred, gt = models.import_model(num_timesteps,
+                                                 num_feats,
+                                                 shard_size,
+                                                 horizon,
+                                                 hidden_size)
+    return [input_tensor, gt], get_loss(pred, gt)
+
+
+def _make_optimizer():
+    return tf.train.AdamOptimizer(learning_rate, epsilon=1.0)
+
+
+def _read_training_data():
+    dataset = data_loader.read_datasets(get_preprocessed_data_path(), seed=shuffle_seed)
+    if prefetch_batches > 0:
+        # shuffles and slices the next batches while the workers compute
+        dataset = prefetcher.PrefetchingDataSet(dataset, batch_size, prefetch_batches)
+    return dataset
+
+
+def _threads_per_worker():
+    # session_threads shared out between the workers, None shares out all cores
+    if session_threads > 0:
+        return max(1, session_threads // num_workers)
+    return None
+
+
+def train_data_parallel():
+    # every update splits a batch of batch_size sequences over num_workers
+    # processes and applies their averaged gradients, the same update as
+    # train() computes on the whole batch
+    if batch_size % num_workers != 0:
+        raise ValueError('batch size {} does not split over {} workers'.format(batch_size, num_workers))
+    dataset = _read_training_data()
+    updates_per_epoch = dataset.num_examples // batch_size
+    checkpoints_folder = os.path.join(working_directory, 'checkpoints')
+    trainer = data_parallel.DataParallelTrainer(_build_training_model, _make_optimizer, num_workers,
+                                                batch_size // num_workers,
+                                                threads_per_worker=_threads_per_worker(),
+                                                log_dir=os.path.join(working_directory, 'logs'))
+    try:
+        for epoch in range(max_epoch):
+            training_loss = 0.0
 
-def evaluate(print_grid=False):
+            widgets = ["epoch #%d|" % epoch, Percentage(), Bar(), ETA()]
+            pbar = ProgressBar(updates_per_epoch, widgets=widgets)
+            pbar.start()
+            for i in range(updates_per_epoch):
+                pbar.update(i)
+                with profiling.span('next_batch'):
+                    batch = dataset.next_batch(batch_size)
+                with profiling.span('data_parallel_step'):
+                    training_loss += trainer.step(data_parallel.split_batch(batch, num_workers))
+
+            training_loss = training_loss/(updates_per_epoch)
+            print("Loss %f" % training_loss)
+
+            # save model and summaries, always after the last epoch
+            if epoch % save_frequency == 0 or epoch == max_epoch - 1:
+                if not os.path.exists(checkpoints_folder):
+                    os.makedirs(checkpoints_folder)
+                trainer.save(os.path.join(checkpoints_folder, 'model.ckpt'), epoch, training_loss)
+    finally:
+        trainer.close()
+        if prefetch_batches > 0:
+            dataset.close()
+    return training_loss
+
+
+def benchmark_data_parallel(worker_counts=(1, 2, 4, 8), steps=50):
+    # training throughput on the real data at every number of workers, for
+    # a fixed batch split ever finer. The batch is batch_size rounded up to
+    # a multiple of every worker count, so each count runs on the same batch.
+    lcm = reduce(lambda a, b: a * b // fractions.gcd(a, b), worker_counts)
+    scaling_batch_size = lcm * max(1, -(-batch_size // lcm))
+    print ("batch size {} for {} workers".format(scaling_batch_size, list(worker_counts)))
+    dataset = data_loader.read_datasets(get_preprocessed_data_path(), seed=shuffle_seed)
+
+    def make_trainer(n):
+        return data_parallel.DataParallelTrainer(_build_training_model, _make_optimizer, n,
+                                                 scaling_batch_size // n)
+
+    def next_shards(n):
+        batch = dataset.next_batch(scaling_batch_size)
+        return data_parallel.split_batch(batch, n), scaling_batch_size
+    return data_parallel.benchmark_scaling(make_trainer, next_shards, worker_counts, steps)
+
+def evaluate(print_grid=False, checkpoint=None, eval_batch_size=None):
+    # returns the mean rmse on the test split of checkpoint, model_path by
+    # default, in batches of eval_batch_size (batch_size by default)
+    eval_batch_size = eval_batch_size or batch_size
     with tf.device('/gpu:0'): # run on specific device
         input_tensor, pred, gt = models.import_model(num_timesteps,
                                                      num_feats,
-                                                     batch_size)
+                                                     eval_batch_size,
+                                                     horizon,
+                                                     hidden_size)
 
-    dataset = data_loader.read_datasets(PREPROCESSED_DATA, dataset_type='test')
+    dataset = data_loader.read_datasets(get_preprocessed_data_path(), dataset_type='test',
+                                        partial_last_batch=True)
 
     saver = tf.train.Saver()
 
-    with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as sess:
-        saver.restore(sess, model_path)
+    with tf.Session(config=_session_config()) as sess:
+        saver.restore(sess, checkpoint or model_path)
 
+        # every test example is scored, the last batch is zero padded up to
+        # eval_batch_size and only its real rows are kept
         all_pred, all_gt = [], []
-        for i in range(updates_per_epoch):
-            input_batch, gt_batch = dataset.next_batch(batch_size)
-            pred_value = sess.run([pred],
-                                  {input_tensor : input_batch,
-                                   gt : [gt_batch]})
+        for i in range(-(-dataset.num_examples // eval_batch_size)):
+            with profiling.span('next_batch'):
+                input_batch, gt_batch = dataset.next_batch(eval_batch_size)
+            num_rows = len(gt_batch)
+            padded_gt = data_loader.pad_batch(gt_batch, eval_batch_size)
+            pred_value = profiling.run(sess, pred,
+                                       {input_tensor : data_loader.pad_batch(input_batch, eval_batch_size),
+                                        gt : padded_gt})
 
-            all_pred.append(pred_value)
+            all_pred.append(np.reshape(pred_value, np.shape(padded_gt))[:num_rows])
             all_gt.append(gt_batch)
 
-        num_align = 0
-        rmse = []
-        for i in range(len(all_pred)):
-            if all_pred[i] == all_gt[i]: num_align += 1
-            rmse.append(np.sqrt(np.power((all_pred[i] - all_gt[i]), 2)))
+        all_pred = np.concatenate(all_pred)
+        all_gt = np.concatenate(all_gt)
+        rmse = np.sqrt(np.power((all_pred - all_gt), 2))
 
-        print "Accuracy:", float(num_align)/len(all_pred)
+        print "Accuracy:", np.mean(all_pred == all_gt)
         print "Avg. RMSE", np.mean(rmse)
         print "Variance RMSE", np.var(rmse)
+    return float(np.mean(rmse))
 
 
 
-def init_model():
-    global _saver
-    global _sess
-    global _input_tensor
-    global _pred
-    global _gt
+# training constants a sweep trial can set, see sweep.py
+trial_params = ('learning_rate', 'batch_size', 'num_timesteps', 'hidden_size', 'max_epoch', 'horizon')
+# every trial is evaluated the same way whatever batch_size it trains with
+trial_eval_batch_size = 64
 
 
-    num_timesteps = 25
-    num_feats = 3
-    batch_size = 1
+def run_trial(config, trial_directory, num_threads=0):
+    # trains config (trial_params name -> value, the rest keep their module
+    # defaults) into trial_directory and evaluates the last checkpoint.
+    # Sets the module's training constants, so run each trial in a fresh
+    # process.
+    global working_directory, session_threads
+    for name, value in config.items():
+        if name not in trial_params:
+            raise ValueError('{} is not a trial parameter, expected one of {}'.format(name, trial_params))
+        globals()[name] = value
+    working_directory = trial_directory
+    session_threads = num_threads
+
+    start = time.time()
+    with tf.Graph().as_default():
+        train_loss = train()
+    train_seconds = time.time() - start
+    checkpoint = tf.train.latest_checkpoint(os.path.join(working_directory, 'checkpoints'))
+    with tf.Graph().as_default():
+        test_rmse = evaluate(checkpoint=checkpoint, eval_batch_size=trial_eval_batch_size)
+    return {'train_loss': float(train_loss),
+            'test_rmse': test_rmse,
+            'train_seconds': train_seconds,
+            'checkpoint': checkpoint}
+
+
+def get_numpy_model_path(checkpoint=None):
+    return (checkpoint or model_path) + '.npz'
+
+
+class UnknownDataset(KeyError):
+    pass
 
-    _input_tensor, _pred, _gt = models.import_model(num_timesteps,
-                                                 num_feats,
-                                                 batch_size)
-    _saver = tf.train.Saver()
-    _sess = tf.Session(config=tf.ConfigProto(allow_soft_placement=True))
-    _saver.restore(_sess, model_path)
+
+class InvalidRequest(ValueError):
+    # bad request parameters, a 400 rather than a server error
+    pass
+
+
+class ModelUnavailable(Exception):
+    # the files of a dataset are there but its model failed to load
+    pass
+
+
+def get_serving_model_path(dataset):
+    # None when the dataset has no checkpoint of its own, a country is never
+    # served from another country's model
+    if dataset in serving_model_paths:
+        return serving_model_paths[dataset]
+    if dataset == default_dataset:
+        return model_path
+    return None
+
+
+def _checkpoint_exists(checkpoint):
+    return any(os.path.exists(path) for path in
+               [checkpoint, checkpoint + '.index', get_numpy_model_path(checkpoint)])
+
+
+def is_serving_dataset(dataset):
+    if dataset not in serving_history_files:
+        return False
+    history_file = serving_history_files[dataset]
+    checkpoint = get_serving_model_path(dataset)
+    return ((os.path.exists(history_file) or dataset_format.find_dataset_dir(history_file) is not None)
+            and checkpoint is not None and _checkpoint_exists(checkpoint))
+
+
+def serving_datasets():
+    return sorted(dataset for dataset in serving_history_files if is_serving_dataset(dataset))
+
+
+def _load_predictor(checkpoint, backend=None):
+    backend = backend or serving_backend
+    if backend == 'auto':
+        backend = 'numpy' if os.path.exists(get_numpy_model_path(checkpoint)) else 'tensorflow'
+    if backend == 'numpy':
+        return numpy_models.NumpyLSTMModel.load(get_numpy_model_path(checkpoint))
+    return model_registry.TFPredictor(checkpoint, serving_batch_size, num_timesteps, num_feats, horizon,
+                                      hidden_size)
+
+
+def _load_serving_model(dataset):
+    # checkpoint, resident history and geometry of one dataset, called by
+    # the model registry the first time the dataset is used
+    if not is_serving_dataset(dataset):
+        raise UnknownDataset('unknown dataset {}'.format(dataset))
+    checkpoint = get_serving_model_path(dataset)
+    return model_registry.ServingModel(
+        dataset,
+        checkpoint,
+        _load_predictor(checkpoint),
+        _dataset_store.get(serving_history_files[dataset]),
+        province_registry.ProvinceRegistry(get_lat_lon_map(dataset_name=dataset)))
+
+
+def _get_model_registry():
+    global _model_registry
+    if _model_registry is None:
+        _model_registry = model_registry.ModelRegistry(_load_serving_model, model_memory_budget)
+    return _model_registry
+
+
+@contextlib.contextmanager
+def _serving_model(dataset):
+    # the model of a dataset, which is not evicted while it is in use
+    registry = _get_model_registry()
+    try:
+        model = registry.acquire(dataset)
+    except UnknownDataset:
+        raise
+    except Exception as e:
+        raise ModelUnavailable('loading the {} model failed: {!r}'.format(dataset, e))
+    try:
+        yield model
+    finally:
+        registry.release(dataset)
+
+
+def init_model(dataset=default_dataset, backend=None):
+    global _forecast_cache
+    global _micro_batcher
+    global serving_backend
+
+    if backend:
+        serving_backend = backend
+    if _forecast_cache is None:
+        _forecast_cache = forecast_cache.ForecastCache(max_entries=forecast_cache_size)
+    if micro_batch_wait > 0 and _micro_batcher is None:
+        _micro_batcher = micro_batcher.MicroBatcher(_run_batched_rollouts,
+                                                    max_wait=micro_batch_wait,
+                                                    max_items=micro_batch_max_scenarios)
+
+    # other datasets are loaded on first use. The baseline never changes for
+    # a checkpoint and history file, so compute it once up front.
+    _get_model_registry().get(dataset)
+    extrapolate_scenarios(dataset, [None])
+
+
+def warm_up(dataset=default_dataset):
+    # synthetic rollout over a full serving batch, so the first real request
+    # doesn't pay for graph or allocator warm-up
+    windows = np.random.RandomState(0).rand(serving_batch_size, num_timesteps, num_feats)
+    windows = windows.astype(np.float32)
+    with _serving_model(dataset) as model:
+        for t in range(num_extrapolate):
+            new_values = np.maximum(0, model.predict(windows))
+            new_samples = np.concatenate((new_values[:, None], windows[:, -1, 1:]), axis=1)
+            windows = np.concatenate((windows[:, 1:, :], new_samples[:, None, :]), axis=1)
+
+
+def _load_model(kwargs):
+    global _model_load_error
+    try:
+        init_model(**kwargs)
+        warm_up(kwargs.get('dataset', default_dataset))
+        _model_ready.set()
+    except Exception:
+        _model_load_error = traceback.format_exc()
+        print (_model_load_error)
+
+
+def init_model_in_background(**kwargs):
+    # init_model and warm_up on a thread, see is_model_ready
+    loader = threading.Thread(target=_load_model, args=(kwargs,))
+    loader.daemon = True
+    loader.start()
+    return loader
+
+
+def is_model_ready():
+    return _model_ready.is_set()
+
+
+def model_load_error():
+    return _model_load_error
+
+
+def reload_data():
+    # rereads the history files and lat/lon maps kept in memory, e.g. after
+    # preprocessing was rerun. Cached forecasts are stale after that.
+    _dataset_store.reload()
+    loaded = _get_model_registry().loaded()
+    for model in loaded:
+        model.dataset = _dataset_store.get(serving_history_files[model.name])
+        model.provinces = province_registry.ProvinceRegistry(get_lat_lon_map(dataset_name=model.name))
+    if _forecast_cache is not None:
+        _forecast_cache.clear()
+        for model in loaded:
+            extrapolate_scenarios(model.name, [None])
 
 
 def close_session():
-    global _sess
-    _sess.close()
+    if _model_registry is not None:
+        _model_registry.clear()
 
 
 def get_lat_lon_map(dataset_name="guinea"):
@@ -169,84 +552,417 @@ def get_lat_lon_map(dataset_name="guinea"):
 def compute_distance(rel_lat_a, rel_lon_a, rel_lat_b, rel_lon_b):
     return np.sqrt(np.square (rel_lat_a - rel_lat_b) + np.square(rel_lon_a - rel_lon_b))
 
-def _extrapolate(history_file, etc_dict=None):
-    global _saver
-    global _sess
-    global _input_tensor
-    global _pred
-    global _gt
-    # etc_dict is a dict mapping from province to # of new ETCs there
-
-    # dataset should be [num_provinces x (num_timesteps, num_feats)]
-    data, provinces = np.load(history_file)
-
-    rel_lat_lon_map = get_lat_lon_map(dataset_name="guinea")
-
-    all_extrapolated = defaultdict(list)
-    all_new_values = defaultdict(list)
-    for province, province_data in zip(provinces, data):
-        # for one province
-        # get lat and lon
-        lat, lon = province_data[0, 1:]
-        extrapolated = []
-        new_values = []
-        old_value = province_data[-1, 0]
+
+def _rollout_mode(model, mode=None):
+    if model.horizon >= num_extrapolate:
+        return 'direct'
+    mode = mode or rollout_mode
+    if mode == 'stateful' and (not model.stateful or model.horizon > 1):
+        return 'window'
+    return mode
+
+
+@contextlib.contextmanager
+def _model_call():
+    # counts and times one session run or numpy forward pass
+    metrics.count_model_call()
+    with metrics.stage('model'), profiling.span('model_call'):
+        yield
+
+
+def _rollout_windows(model, windows, lat_lon, factors, mode=None):
+    # extrapolates num_extrapolate values for every row of windows
+    # [rows, num_timesteps, num_feats], scaling the predictions of row i by
+    # factors[i] and feeding them back with lat_lon[i]
+    mode = _rollout_mode(model, mode)
+    if mode == 'direct':
+        # the whole horizon in one forward pass, nothing is fed back so the
+        # etc factors simply scale every predicted value
+        with _model_call():
+            preds = model.predict_horizon(windows)[:, :num_extrapolate]
+        extrapolated = np.maximum(0, preds * factors[:, None])
+    elif mode == 'stateful':
+        # the lstm state already holds the window, only feed the new sample
+        with _model_call():
+            preds, state = model.start(windows)
+        extrapolated = np.zeros((len(windows), num_extrapolate), dtype=np.float32)
         for t in range(num_extrapolate):
-            pred_value = _sess.run([_pred],
-                                  {_input_tensor: province_data})[0][0][0]
-
-            # pred_value = max(old_value, pred_value)
-
-            new_value = pred_value
-
-            # if etc_dict and province in etc_dict:
-            #     # new_value = old_value + ((pred_value - old_value) * (1/(etc_dict[province] + 2)))
-            #     new_value *= (1 - etc_dict[province] * 0.1)
-
-            # see if hospital is nearby
-            if etc_dict:
-                for etc_province in etc_dict.keys():
-                    etc_lat, etc_lon = rel_lat_lon_map[etc_province]
-                    distance_to_etc = compute_distance(etc_lat, etc_lon, lat, lon)
-                    # print ("distance to etc {}",format(distance_to_etc))
-                    if distance_to_etc < 0.3:
-                        factor = (1 - (etc_dict[etc_province] * 0.1 * min(1, 1/(distance_to_etc * 10))))
-                        new_value *= factor
-                        # print ("hospital nearby, factor {}".format(factor))
-
-
-            new_value = max(0, new_value)
-            extrapolated.append(new_value)
-            # old_value = pred_value
-            new_values.append(new_value)
-            new_sample = np.array([new_value, lat, lon])
-
-            new_sample = np.reshape(new_sample, (1, -1))
-            province_data = province_data[1:, :]
-            province_data = np.concatenate((province_data, new_sample), axis=0)
-            # make example with [pred_value, lat, lon]
-            # remove first element in input batch and add extrapolated
-        all_extrapolated[province] = extrapolated
-        all_new_values[province] = new_values
+            new_values = np.maximum(0, preds * factors)
+            extrapolated[:, t] = new_values
+            if t + 1 < num_extrapolate:
+                # make examples with [new_value, lat, lon]
+                new_samples = np.concatenate((new_values[:, None], lat_lon), axis=1)
+                with _model_call():
+                    preds, state = model.step(new_samples, state)
+    else:
+        # every province of every scenario moves forward model.horizon
+        # timesteps per model call
+        extrapolated = np.zeros((len(windows), num_extrapolate), dtype=np.float32)
+        t = 0
+        while t < num_extrapolate:
+            num_new = min(model.horizon, num_extrapolate - t)
+            with _model_call():
+                preds = model.predict_horizon(windows)[:, :num_new]
+            new_values = np.maximum(0, preds * factors[:, None])
+            extrapolated[:, t:t + num_new] = new_values
+
+            # make examples with [new_value, lat, lon], remove the first
+            # elements in every input window and add the extrapolated ones
+            new_samples = np.concatenate((new_values[:, :, None],
+                                          np.repeat(lat_lon[:, None, :], num_new, axis=1)), axis=2)
+            windows = np.concatenate((windows[:, num_new:, :], new_samples), axis=1)
+            t += num_new
+
+    return extrapolated
+
+
+def _extrapolate(model, etc_dicts, province_rows=None, mode=None):
+    # etc_dicts is a list of scenarios, each a dict mapping from province to
+    # # of new ETCs there (None or {} for no new ETCs). province_rows
+    # optionally restricts the rollout to some rows of the history file.
+
+    # resident copy of the history file, windows are
+    # [num_provinces x (num_timesteps, num_feats)]
+    dataset = model.dataset
+    if province_rows is None:
+        province_rows = np.arange(dataset.num_provinces)
+    provinces = [dataset.provinces[row] for row in province_rows]
+    province_windows = dataset.windows[province_rows]
+    num_provinces = len(provinces)
+    num_scenarios = len(etc_dicts)
+
+    registry = model.provinces
+    province_indices = registry.indices(provinces)
+
+    # scenarios are stacked along the batch axis: row s * num_provinces + p
+    # is province p under scenario s. The etc factor of a province only
+    # depends on where it is, not on t, so it is computed once up front.
+    lat_lon = np.tile(dataset.lat_lon[province_rows], (num_scenarios, 1))
+    with metrics.stage('etc_factors'):
+        factors = np.concatenate([registry.etc_factors(etc_dict, province_indices)
+                                  for etc_dict in etc_dicts])
+    windows = np.tile(province_windows, (num_scenarios, 1, 1))
+
+    with metrics.stage('rollout'):
+        extrapolated = _rollout_windows(model, windows, lat_lon, factors, mode)
+    extrapolated = np.reshape(extrapolated, (num_scenarios, num_provinces, num_extrapolate))
+    all_extrapolated = []
+    for scenario in extrapolated:
+        all_extrapolated.append(dict(zip(provinces, scenario.tolist())))
 
     return all_extrapolated
 
 
-def extrapolate(history_file, etc_dict=None):
-    global _saver
-    global _sess
-    global _input_tensor
-    global _pred
-    global _gt
-    without_etcs = _extrapolate(history_file)
-    with_etcs = _extrapolate(history_file, etc_dict=etc_dict)
+def _extrapolate_ensemble(model, etc_dicts, num_members=None, noise=None, quantiles=None):
+    # monte carlo ensemble: every member reads the history with the case
+    # counts perturbed by multiplicative gaussian noise. The model has no
+    # dropout to sample, so the input is the only thing perturbed. Members
+    # of all scenarios are stacked along the batch axis (row
+    # (m * num_scenarios + s) * num_provinces + p) and rolled out together.
+    # Every scenario sees the same noise, so differences between scenarios
+    # are due to the etcs and not to the draw. Returns one
+    # {province: [num_quantiles x num_extrapolate]} dict per scenario.
+    num_members = num_members or ensemble_size
+    noise = ensemble_noise if noise is None else noise
+    quantiles = quantiles or ensemble_quantiles
+
+    dataset = model.dataset
+    registry = model.provinces
+    num_provinces = dataset.num_provinces
+    num_scenarios = len(etc_dicts)
+    province_indices = registry.indices(dataset.provinces)
+
+    rng = np.random.RandomState(ensemble_seed)
+    member_noise = rng.normal(1.0, noise, (num_members, 1, num_provinces, num_timesteps))
+    windows = np.tile(dataset.windows, (num_members, num_scenarios, 1, 1, 1))
+    windows[:, :, :, :, 0] *= np.maximum(0, member_noise)
+    windows = np.reshape(windows, (-1, num_timesteps, num_feats)).astype(np.float32)
+
+    scenario_factors = np.concatenate([registry.etc_factors(etc_dict, province_indices)
+                                       for etc_dict in etc_dicts])
+    factors = np.tile(scenario_factors, num_members)
+    lat_lon = np.tile(dataset.lat_lon, (num_members * num_scenarios, 1))
+
+    extrapolated = _rollout_windows(model, windows, lat_lon, factors)
+    extrapolated = np.reshape(extrapolated, (num_members, num_scenarios, num_provinces, num_extrapolate))
+    # [num_quantiles, num_scenarios, num_provinces, num_extrapolate]
+    bands = np.percentile(extrapolated, [100.0 * q for q in quantiles], axis=0)
+
+    all_bands = []
+    for s in range(num_scenarios):
+        all_bands.append(dict((province, bands[:, s, p, :].tolist())
+                              for p, province in enumerate(dataset.provinces)))
+    return all_bands
+
+
+def _cache_key(model, etc_dict):
+    return (model.model_path, model.history_file, _rollout_mode(model),
+            forecast_cache.canonical_etc_key(etc_dict))
+
+
+def _check_etc_dict(model, etc_dict):
+    # runs on the request thread, so a bad placement is the 400 of its own
+    # request and never reaches a rollout shared with other requests
+    if etc_dict is None:
+        return
+    if not isinstance(etc_dict, dict):
+        raise InvalidRequest('ETCs must be a {province: # of ETCs} object')
+    unknown = sorted(province for province in etc_dict if province not in model.provinces)
+    if unknown:
+        raise InvalidRequest('unknown provinces {}'.format(', '.join(unknown)))
+
+
+def _batched_rollout(model, requests):
+    keys, etc_dicts = [], []
+    for scenarios in requests:
+        for etc_dict in scenarios:
+            key = _cache_key(model, etc_dict)
+            if key not in keys:
+                keys.append(key)
+                etc_dicts.append(etc_dict)
+    extrapolated = dict(zip(keys, _extrapolate(model, etc_dicts)))
+    return [[extrapolated[_cache_key(model, etc_dict)] for etc_dict in scenarios]
+            for scenarios in requests]
+
+
+def _run_batched_rollouts(dataset, requests):
+    # micro batcher callback: rolls the scenarios of all requests out
+    # together, each distinct placement once, and splits the results back up.
+    # When the shared rollout fails every request is rolled out on its own,
+    # so only the one that broke it gets the error.
+    with _serving_model(dataset) as model:
+        try:
+            return _batched_rollout(model, requests)
+        except Exception:
+            if len(requests) == 1:
+                raise
+        results = []
+        for scenarios in requests:
+            try:
+                results.append(_batched_rollout(model, [scenarios])[0])
+            except Exception as e:
+                results.append(micro_batcher.Failed(e))
+        return results
+
+
+def _rollout(model, etc_dicts):
+    # concurrent requests share one rollout when micro batching is on
+    if _micro_batcher is not None:
+        return _micro_batcher.submit(model.name, etc_dicts)
+    return _extrapolate(model, etc_dicts)
+
+
+def _cached_extrapolate_scenarios(model, etc_dicts):
+    # looks every scenario up in the forecast cache and rolls out the missing
+    # ones together, returns the per scenario results and how many were cached
+    for etc_dict in etc_dicts:
+        _check_etc_dict(model, etc_dict)
+    results = [None] * len(etc_dicts)
+    missing = {}
+    with metrics.stage('cache_lookup'):
+        for i, etc_dict in enumerate(etc_dicts):
+            key = _cache_key(model, etc_dict)
+            cached = _forecast_cache.get(key) if _forecast_cache is not None else None
+            if cached is not None:
+                results[i] = cached
+            else:
+                missing.setdefault(key, []).append(i)
+    num_cached = len(etc_dicts) - sum(len(indices) for indices in missing.values())
+
+    if missing:
+        keys = missing.keys()
+        extrapolated = _rollout(model, [etc_dicts[missing[key][0]] for key in keys])
+        for key, scenario in zip(keys, extrapolated):
+            if _forecast_cache is not None:
+                _forecast_cache.put(key, scenario)
+            for i in missing[key]:
+                results[i] = scenario
+
+    return results, num_cached
+
+
+def extrapolate_scenarios(dataset, etc_dicts):
+    # one rollout for any number of etc placements, returns one
+    # {province: values} dict per entry of etc_dicts
+    with _serving_model(dataset) as model:
+        results, _ = _cached_extrapolate_scenarios(model, list(etc_dicts))
+    return results
+
+
+def extrapolate_with_cache_status(dataset, etc_dict=None):
+    # same as extrapolate, plus whether both curves came from the cache
+    with _serving_model(dataset) as model:
+        (without_etcs, with_etcs), num_cached = _cached_extrapolate_scenarios(model,
+                                                                              [None, etc_dict])
 
     both_graphs = {}
     for province in without_etcs.keys():
-        both_graphs[province] = [without_etcs[province], with_etcs[province]]
+        both_graphs[province] = [list(without_etcs[province]), list(with_etcs[province])]
+    return both_graphs, num_cached == 2
+
+
+def iter_extrapolate(dataset, etc_dict=None, chunk_size=None):
+    # yields (province, [without_etcs, with_etcs]) as soon as the chunk of
+    # provinces it is in has been rolled out. Cached scenarios are served
+    # straight away and the missing ones are cached once the last chunk is done.
+    chunk_size = chunk_size or stream_chunk_size
+    with _serving_model(dataset) as model:
+        _check_etc_dict(model, etc_dict)
+        etc_dicts = [None, etc_dict]
+        keys = [_cache_key(model, etc_dict) for etc_dict in etc_dicts]
+        cached = [_forecast_cache.get(key) if _forecast_cache is not None else None
+                  for key in keys]
+
+        missing_keys = []
+        for key, scenario in zip(keys, cached):
+            if scenario is None and key not in missing_keys:
+                missing_keys.append(key)
+        missing_etc_dicts = [etc_dicts[keys.index(key)] for key in missing_keys]
+        rolled_out = dict((key, {}) for key in missing_keys)
+
+        history = model.dataset
+        for start in range(0, history.num_provinces, chunk_size):
+            rows = np.arange(start, min(start + chunk_size, history.num_provinces))
+            if missing_keys:
+                chunk = _extrapolate(model, missing_etc_dicts, rows)
+                for key, scenario in zip(missing_keys, chunk):
+                    rolled_out[key].update(scenario)
+
+            for row in rows:
+                province = history.provinces[row]
+                series = []
+                for key, scenario in zip(keys, cached):
+                    if scenario is None:
+                        scenario = rolled_out[key]
+                    series.append(list(scenario[province]))
+                yield province, series
+
+        if _forecast_cache is not None:
+            for key in missing_keys:
+                _forecast_cache.put(key, rolled_out[key])
+
+
+def extrapolate_bands(dataset, etc_dict=None):
+    # per step ensemble quantiles, {province: [without_etcs, with_etcs]}
+    # where both are [num_quantiles x num_extrapolate]
+    with _serving_model(dataset) as model:
+        _check_etc_dict(model, etc_dict)
+        ensemble = ('ensemble', ensemble_size, ensemble_noise, tuple(ensemble_quantiles), ensemble_seed)
+        keys = [_cache_key(model, scenario) + ensemble for scenario in [None, etc_dict]]
+        cached = [_forecast_cache.get(key) if _forecast_cache is not None else None
+                  for key in keys]
+        if None in cached:
+            cached = _extrapolate_ensemble(model, [None, etc_dict])
+            if _forecast_cache is not None:
+                for key, scenario in zip(keys, cached):
+                    _forecast_cache.put(key, scenario)
+        without_etcs, with_etcs = cached
+
+    both_bands = {}
+    for province in without_etcs.keys():
+        both_bands[province] = [without_etcs[province], with_etcs[province]]
+    return {'quantiles': list(ensemble_quantiles), 'forecasts': both_bands}
+
+
+def extrapolate(dataset=default_dataset, etc_dict=None):
+    both_graphs, _ = extrapolate_with_cache_status(dataset, etc_dict)
     return both_graphs
 
 
+def micro_batch_stats():
+    if _micro_batcher is None:
+        return {}
+    return _micro_batcher.stats()
+
+
+def cache_stats():
+    if _forecast_cache is None:
+        return {}
+    return _forecast_cache.stats()
+
+
+def model_registry_stats():
+    return _get_model_registry().stats()
+
+
+def serving_gauges():
+    # current cache, micro batching and model registry numbers for /metrics
+    gauges = {'forecast_model_ready': int(is_model_ready())}
+    for name, value in cache_stats().items():
+        gauges['forecast_cache_' + name] = value
+    for name in ['batches', 'requests']:
+        if name in micro_batch_stats():
+            gauges['forecast_micro_batch_' + name] = micro_batch_stats()[name]
+    registry = model_registry_stats()
+    gauges['forecast_models_loaded'] = len(registry['loaded'])
+    gauges['forecast_model_bytes'] = [({'dataset': name}, nbytes) for name, nbytes in registry['loaded']]
+    gauges['forecast_model_loads'] = registry['loads']
+    gauges['forecast_model_evictions'] = registry['evictions']
+    return gauges
+
+
+def _total_cases(scenario):
+    return sum(sum(values) for values in scenario.values())
+
+
+def optimize_placements(dataset, budget, provinces=None, beam_width=1, top_k=3):
+    # searches where to put budget new ETCs so that the total projected cases
+    # over the num_extrapolate horizon are lowest. Every round adds one ETC to
+    # every placement kept in the beam (beam_width 1 is greedy) and rolls all
+    # the candidates out together. provinces optionally limits where ETCs go,
+    # and a province can get several of them.
+    if not 1 <= budget <= optimize_max_budget:
+        raise InvalidRequest('budget must be between 1 and {}'.format(optimize_max_budget))
+    if not 1 <= beam_width <= optimize_max_beam_width:
+        raise InvalidRequest('beam_width must be between 1 and {}'.format(optimize_max_beam_width))
+    if not 1 <= top_k <= optimize_max_top_k:
+        raise InvalidRequest('top_k must be between 1 and {}'.format(optimize_max_top_k))
+    with _serving_model(dataset) as model:
+        if provinces is None:
+            provinces = model.dataset.provinces
+        unknown = [province for province in provinces if province not in model.provinces]
+        if unknown:
+            raise InvalidRequest('unknown provinces {}'.format(', '.join(unknown)))
+        provinces = sorted(set(provinces))
+        if not provinces:
+            raise InvalidRequest('no provinces to put ETCs in')
+
+        # the baseline is the same for every candidate, served from the cache
+        (without_etcs,), _ = _cached_extrapolate_scenarios(model, [None])
+        baseline = _total_cases(without_etcs)
+
+        beam = scored = [({}, baseline, without_etcs)]
+        for _ in range(budget):
+            candidates = {}
+            for etc_dict, _, _ in beam:
+                for province in provinces:
+                    candidate = dict(etc_dict)
+                    candidate[province] = candidate.get(province, 0) + 1
+                    candidates.setdefault(forecast_cache.canonical_etc_key(candidate), candidate)
+            if not candidates:
+                break
+
+            # candidates are not cached, there are too many of them and
+            # planners only look at the best few
+            etc_dicts = candidates.values()
+            extrapolated = _extrapolate(model, etc_dicts)
+            scored = [(etc_dict, _total_cases(scenario), scenario)
+                      for etc_dict, scenario in zip(etc_dicts, extrapolated)]
+            scored.sort(key=lambda candidate: candidate[1])
+            beam = scored[:beam_width]
+
+    placements = []
+    for etc_dict, total, with_etcs in scored[:top_k]:
+        forecasts = {}
+        for province in without_etcs.keys():
+            forecasts[province] = [list(without_etcs[province]), list(with_etcs[province])]
+        placements.append({'etcs': etc_dict,
+                           'total_cases': total,
+                           'cases_averted': baseline - total,
+                           'forecasts': forecasts})
+    return {'baseline_cases': baseline, 'placements': placements}
+
+
 test_dict = {
     "macenta": 2,
     "coyah": 1,
@@ -255,9 +971,84 @@ test_dict = {
 
 
 
-def test_those_globals():
-    init_model()
-    graphs_dict = extrapolate(PREPROCESSED_GUINEA_DATA_EXTRA, test_dict)
+def export_numpy_model():
+    # dumps the restored checkpoint for the tensorflow free serving backend
+    predictor = model_registry.TFPredictor(model_path, serving_batch_size, num_timesteps, num_feats,
+                                           horizon, hidden_size)
+    numpy_models.export_weights(predictor.session, get_numpy_model_path())
+
+
+def check_numpy_model(dataset=default_dataset, tolerance=1e-3):
+    # parity check of the exported numpy model against the checkpoint, on the
+    # history windows, on test windows and on full extrapolations
+    history = _dataset_store.get(serving_history_files[dataset])
+    provinces = province_registry.ProvinceRegistry(get_lat_lon_map(dataset_name=dataset))
+    tf_model = model_registry.ServingModel(dataset, model_path,
+                                           _load_predictor(model_path, backend='tensorflow'),
+                                           history, provinces)
+    np_model = model_registry.ServingModel(dataset, model_path,
+                                           _load_predictor(model_path, backend='numpy'),
+                                           history, provinces)
+
+    test_windows = np.array(data_loader.read_datasets(PREPROCESSED_DATA, dataset_type='test').data,
+                            dtype=np.float32)
+
+    max_diff = 0.0
+    for name, windows in [('history', history.windows), ('test', test_windows)]:
+        tf_preds = tf_model.predict(windows)
+        np_preds = np_model.predict(windows)
+        diff = np.max(np.abs(tf_preds - np_preds) / np.maximum(1, np.abs(tf_preds)))
+        print ("{}: {} windows, max relative difference {}".format(name, len(windows), diff))
+        max_diff = max(max_diff, diff)
+
+    tf_curves = _extrapolate(tf_model, [None, test_dict])
+    np_curves = _extrapolate(np_model, [None, test_dict])
+    for tf_scenario, np_scenario in zip(tf_curves, np_curves):
+        for province in tf_scenario:
+            tf_values, np_values = np.array(tf_scenario[province]), np.array(np_scenario[province])
+            diff = np.max(np.abs(tf_values - np_values) / np.maximum(1, np.abs(tf_values)))
+            max_diff = max(max_diff, diff)
+    print ("extrapolation: max relative difference {}".format(max_diff))
+    tf_model.close()
+
+    assert max_diff < tolerance, "numpy model differs from {}".format(model_path)
+    print ("numpy model matches {}".format(model_path))
+
+
+def compare_rollout_modes(dataset=default_dataset, repeats=3):
+    # accuracy and speed of stateful rollouts against the window rollouts
+    # the model was trained for. Both read the history window from a zero
+    # state, so the first value matches exactly. After that the stateful
+    # lstm still remembers the samples that slid out of the window, which the
+    # window rollout forgets, so the curves drift apart a little every step.
+    with _serving_model(dataset) as model:
+        if not model.stateful:
+            print ("{} has no stateful backend, export a numpy model first".format(model.model_path))
+            return
+        etc_dicts = [None, test_dict]
+
+        curves, seconds = {}, {}
+        for mode in ['window', 'stateful']:
+            start = time.time()
+            for _ in range(repeats):
+                curves[mode] = _extrapolate(model, etc_dicts, mode=mode)
+            seconds[mode] = (time.time() - start) / repeats
+
+    window = np.array([[scenario[p] for p in sorted(scenario)] for scenario in curves['window']])
+    stateful = np.array([[scenario[p] for p in sorted(scenario)] for scenario in curves['stateful']])
+    abs_diff = np.abs(window - stateful)
+    rel_diff = abs_diff / np.maximum(1, np.abs(window))
+    print ("step  mean abs diff  max rel diff")
+    for t in range(num_extrapolate):
+        print ("{:4d}  {:13.6f}  {:12.6f}".format(t + 1, abs_diff[:, :, t].mean(), rel_diff[:, :, t].max()))
+    print ("total cases: window {:.3f}, stateful {:.3f}".format(window.sum(), stateful.sum()))
+    print ("rollout of {} scenarios: window {:.4f}s, stateful {:.4f}s, {:.1f}x faster".format(
+        len(etc_dicts), seconds['window'], seconds['stateful'], seconds['window'] / seconds['stateful']))
+
+
+def test_those_globals(dataset=default_dataset):
+    init_model(dataset)
+    graphs_dict = extrapolate(dataset, test_dict)
     for (province, graphs) in graphs_dict.iteritems():
         print province
         print graphs
@@ -266,30 +1057,63 @@ def test_those_globals():
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Epidemic Response System')
     parser.add_argument('-wd', '--working_directory', help='directory for storing logs')
-    parser.add_argument('-sf', '--save_frequency', help='Number of epochs before saving')
+    parser.add_argument('-sf', '--save_frequency', type=int, help='Number of epochs before saving')
     parser.add_argument('--model_path', help='Stored model path')
-    parser.add_argument('mode', choices=('train', 'eval', 'extrapolate', 'etc_user'), help='train or eval')
+    parser.add_argument('--batch_size', '--batch-size', type=int, default=batch_size,
+                        help='sequences per training step')
+    parser.add_argument('--prefetch', type=int, default=prefetch_batches,
+                        help='batches to prepare ahead of training on a background thread')
+    parser.add_argument('--dataset', default=default_dataset, choices=sorted(serving_history_files.keys()),
+                        help='dataset to extrapolate')
+    parser.add_argument('--profile', action='store_true',
+                        help='write a cProfile hotspot report and a chrome trace of the run')
+    parser.add_argument('--profile_dir', default='profile/', help='where --profile writes to')
+    parser.add_argument('--workers', type=int, default=num_workers,
+                        help='processes training data parallel, each on batch_size / workers sequences')
+    parser.add_argument('--horizon', type=int, default=horizon,
+                        help='values predicted per forward pass, > 1 trains a multi-horizon model')
+    parser.add_argument('--hidden_size', type=int, default=hidden_size, help='lstm units of the model')
+    parser.add_argument('--budget', type=int, default=3, help='number of new ETCs to place')
+    parser.add_argument('--beam_width', type=int, default=1, help='placements kept per round, 1 is greedy')
+    parser.add_argument('mode', choices=('train', 'eval', 'extrapolate', 'etc_user', 'export', 'check_export', 'optimize', 'compare_rollouts', 'scaling'), help='train or eval')
     args = parser.parse_args()
 
+    if args.working_directory:
+        working_directory = args.working_directory
+    if args.save_frequency:
+        save_frequency = args.save_frequency
+    if args.model_path:
+        model_path = args.model_path
+    batch_size = args.batch_size
+    prefetch_batches = args.prefetch
+    num_workers = args.workers
+    horizon = args.horizon
+    hidden_size = args.hidden_size
+    if args.profile:
+        profiling.start(args.profile_dir, args.mode)
+
     if args.mode == 'train':
         train()
     elif args.mode == 'eval':
         evaluate(print_grid=False)
     elif args.mode == 'extrapolate':
-        extrapolate(PREPROCESSED_GUINEA_DATA_EXTRA)
+        extrapolate(args.dataset)
     elif args.mode == 'etc_user':
-        test_those_globals()
+        test_those_globals(args.dataset)
         # extrapolate(PREPROCESSED_GUINEA_DATA_EXTRA, test_dict)
-
-    if args.working_directory:
-        working_directory = args.working_directory
-    else:
-        working_directory = 'trial/'
-    if args.save_frequency:
-        save_frequency = args.save_frequency
-    else:
-        save_frequency = 10
-    if args.model_path:
-        model_path = args.model_path
-    else:
-        model_path = 'good_checkpoints/model.ckpt-50'
+    elif args.mode == 'export':
+        export_numpy_model()
+    elif args.mode == 'check_export':
+        check_numpy_model(args.dataset)
+    elif args.mode == 'compare_rollouts':
+        compare_rollout_modes(args.dataset)
+    elif args.mode == 'scaling':
+        benchmark_data_parallel()
+    elif args.mode == 'optimize':
+        init_model(args.dataset)
+        result = optimize_placements(args.dataset, args.budget, beam_width=args.beam_width)
+        print ("baseline: {:.1f} cases".format(result['baseline_cases']))
+        for placement in result['placements']:
+            print ("{}: {:.1f} cases, {:.1f} averted".format(placement['etcs'],
+                                                             placement['total_cases'],
+                                                             placement['cases_averted']))
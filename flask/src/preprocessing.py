@@ -23,6 +23,7 @@ import pickle
 from sklearn.cross_validation import train_test_split
 
 from constants import *
+from dataset_format import save_dataset_dir
 from collections import defaultdict
 from dateutil.parser import parse
 from dateutil.relativedelta import relativedelta
@@ -123,7 +124,9 @@ def get_data_dict_from_clean_csv(clean_csv_file=CLEAN_GUINEA_DATA_PATH, dataset_
     return data_dict_by_province
 
 
-def convert_clean_csv_to_numpy_for_rnn(clean_csv_file=CLEAN_GUINEA_DATA_PATH, dataset_name="guinea",  num_timesteps=25, case_type = "confirmed cases"):
+def convert_clean_csv_to_numpy_for_rnn(clean_csv_file=CLEAN_GUINEA_DATA_PATH, dataset_name="guinea",  num_timesteps=25, case_type = "confirmed cases", horizon=1):
+    # horizon > 1 labels every window with the next horizon values instead of
+    # only the next one, for models.import_model(..., _horizon=horizon)
     data_dict_by_province = get_data_dict_from_clean_csv(clean_csv_file=clean_csv_file, dataset_name=dataset_name, case_type=case_type)
     data = []
     labels = []
@@ -133,7 +136,7 @@ def convert_clean_csv_to_numpy_for_rnn(clean_csv_file=CLEAN_GUINEA_DATA_PATH, da
         # for each province, go through all the rows:
         rows = sorted(rows, key=lambda x: (x[4]))  # sort by date
 
-        for i in xrange(len(rows) - num_timesteps - 1):
+        for i in xrange(len(rows) - num_timesteps - horizon):
             # since we are predicting the next timestep, we don't use the features from the last
             # timestep, since we wouldn't know what the prediction would be.
             sample_across_timesteps = []
@@ -146,11 +149,21 @@ def convert_clean_csv_to_numpy_for_rnn(clean_csv_file=CLEAN_GUINEA_DATA_PATH, da
                 # prev_num_cases = num_cases
                 sample_across_timesteps.append(np.array([num_cases, rel_lat, rel_lon]))
             data.append(np.array(sample_across_timesteps))
-            labels.append(int(rows[i + num_timesteps][3]))
+            if horizon == 1:
+                labels.append(int(rows[i + num_timesteps][3]))
+            else:
+                labels.append([int(rows[i + num_timesteps + k][3]) for k in xrange(horizon)])
 
     dataset = train_test_split(np.array(data), np.array(labels), test_size=0.10, random_state=42)
 
-    np.save("../data/preprocessed/" + dataset_name + "_" + str(num_timesteps) + ".npy", dataset)
+    X_train, X_test, y_train, y_test = dataset
+    suffix = "" if horizon == 1 else "_h" + str(horizon)
+    # a dataset directory next to where the pickled .npy used to go, which
+    # data_loader.read_datasets still finds under the old .npy name
+    save_dataset_dir(PREPROCESSED_DIR + dataset_name + "_" + str(num_timesteps) + suffix,
+                     {'X_train': X_train, 'X_test': X_test, 'y_train': y_train, 'y_test': y_test},
+                     dataset_name=dataset_name, num_timesteps=num_timesteps, horizon=horizon,
+                     case_type=case_type)
     print ("finished processing data to numpy.")
 
 
@@ -268,9 +281,10 @@ def create_data_for_extrapolation_aligned_by_time(clean_csv_file=CLEAN_GUINEA_DA
         data.append(np.array(sample_across_timesteps))
         labels.append(int(rows[i + num_timesteps][3]))
 
-    dataset = data, provinces
-
-    np.save("../data/preprocessed/" + dataset_name + "_" + str(num_timesteps) + "_for_extrapolation.npy", dataset)
+    save_dataset_dir("../data/preprocessed/" + dataset_name + "_" + str(num_timesteps) + "_for_extrapolation",
+                     {'data': np.array(data), 'labels': np.array(labels)},
+                     dataset_name=dataset_name, num_timesteps=num_timesteps, case_type=case_type,
+                     provinces=provinces)
     print ("finished processing data for extrapolation.")
 
 
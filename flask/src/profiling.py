@@ -0,0 +1,153 @@
+import atexit
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+
+from cStringIO import StringIO
+from contextlib import contextmanager
+
+# session runs that get a full tensorflow step trace, tracing every step
+# slows training down too much
+trace_session_runs = 20
+num_hotspots = 40
+
+_profiler = None
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_null_span = _NullSpan()
+
+
+class Profiler(object):
+    # cProfile for the python side plus chrome trace events: one span per
+    # with span(...) block, and the op level step stats of the first
+    # trace_session_runs session runs. Writes <name>.prof, <name>_hotspots.txt
+    # and <name>_trace.json (chrome://tracing) to output_dir on stop().
+    def __init__(self, output_dir, name):
+        self._output_dir = output_dir
+        self._name = name
+        self._profile = cProfile.Profile()
+        self._events = []
+        self._lock = threading.Lock()
+        self._num_session_runs = 0
+        self._pid = os.getpid()
+
+    def start(self):
+        self._start = time.time()
+        self._profile.enable()
+
+    def _add_event(self, name, start, end, args=None):
+        event = {'name': name, 'cat': 'python', 'ph': 'X', 'pid': self._pid,
+                 'tid': threading.current_thread().name,
+                 'ts': start * 1e6, 'dur': (end - start) * 1e6}
+        if args:
+            event['args'] = args
+        with self._lock:
+            self._events.append(event)
+
+    @contextmanager
+    def span(self, name, **args):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self._add_event(name, start, time.time(), args)
+
+    def run(self, sess, fetches, feed_dict=None):
+        # sess.run, timed as a span and with a tensorflow step trace while
+        # the first trace_session_runs runs last
+        self._num_session_runs += 1
+        trace = self._num_session_runs <= trace_session_runs
+        options, run_metadata = None, None
+        if trace:
+            try:
+                import tensorflow as tf
+                options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+                run_metadata = tf.RunMetadata()
+            except (ImportError, AttributeError):
+                trace = False
+
+        start = time.time()
+        if trace:
+            result = sess.run(fetches, feed_dict, options=options, run_metadata=run_metadata)
+        else:
+            result = sess.run(fetches, feed_dict)
+        self._add_event('session_run', start, time.time(), {'step': self._num_session_runs})
+        if trace:
+            self._add_step_stats(run_metadata)
+        return result
+
+    def _add_step_stats(self, run_metadata):
+        # timeline timestamps are wall clock microseconds like the spans
+        try:
+            from tensorflow.python.client import timeline
+        except ImportError:
+            return
+        trace = json.loads(timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format())
+        with self._lock:
+            for event in trace.get('traceEvents', []):
+                # keep devices apart from the python process
+                event['pid'] = 'tf:{}'.format(event.get('pid'))
+                self._events.append(event)
+
+    def stop(self):
+        self._profile.disable()
+        self._add_event(self._name, self._start, time.time())
+        if not os.path.exists(self._output_dir):
+            os.makedirs(self._output_dir)
+        path = os.path.join(self._output_dir, self._name)
+
+        self._profile.dump_stats(path + '.prof')
+        report = StringIO()
+        stats = pstats.Stats(self._profile, stream=report)
+        stats.strip_dirs()
+        report.write('== by cumulative time ==\n')
+        stats.sort_stats('cumulative').print_stats(num_hotspots)
+        report.write('== by own time ==\n')
+        stats.sort_stats('time').print_stats(num_hotspots)
+        with open(path + '_hotspots.txt', 'w') as f:
+            f.write(report.getvalue())
+
+        with open(path + '_trace.json', 'w') as f:
+            json.dump({'traceEvents': self._events, 'displayTimeUnit': 'ms'}, f)
+        print ("profile written to {}.prof, {}_hotspots.txt and {}_trace.json".format(path, path, path))
+
+
+def start(output_dir, name):
+    # profiles until stop(), or until the process exits, so a training run
+    # stopped with ctrl-c still writes its profile
+    global _profiler
+    _profiler = Profiler(output_dir, '{}_{}'.format(name, time.strftime('%Y%m%d-%H%M%S')))
+    _profiler.start()
+    atexit.register(stop)
+    return _profiler
+
+
+def stop():
+    global _profiler
+    if _profiler is not None:
+        _profiler.stop()
+        _profiler = None
+
+
+def span(name, **args):
+    # times the with block when profiling, costs next to nothing otherwise
+    if _profiler is None:
+        return _null_span
+    return _profiler.span(name, **args)
+
+
+def run(sess, fetches, feed_dict=None):
+    # drop in for sess.run(fetches, feed_dict)
+    if _profiler is None:
+        return sess.run(fetches, feed_dict)
+    return _profiler.run(sess, fetches, feed_dict)
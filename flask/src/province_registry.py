@@ -0,0 +1,60 @@
+import numpy as np
+
+# ETCs only affect provinces closer than this (in relative lat/lon units)
+etc_radius = 0.3
+
+
+class ProvinceRegistry(object):
+    def __init__(self, rel_lat_lon_map):
+        self._provinces = sorted(rel_lat_lon_map.keys())
+        self._index = dict((province, i) for i, province in enumerate(self._provinces))
+        self._lat_lon = np.array([rel_lat_lon_map[province] for province in self._provinces],
+                                 dtype=np.float64)
+
+        # pairwise distances, [num_provinces x num_provinces]
+        diff = self._lat_lon[:, None, :] - self._lat_lon[None, :, :]
+        self._distances = np.sqrt(np.sum(np.square(diff), axis=2))
+        self._neighbours = self._distances < etc_radius
+
+        # how much one ETC in province a reduces new cases in province b,
+        # 0.1 * min(1, 1 / (distance * 10)) within the radius and 0 outside
+        with np.errstate(divide='ignore'):
+            scale = np.minimum(1, 1 / (self._distances * 10))
+        self._attenuation = np.where(self._neighbours, 0.1 * scale, 0)
+
+    @property
+    def provinces(self):
+        return self._provinces
+
+    @property
+    def distances(self):
+        return self._distances
+
+    @property
+    def neighbours(self):
+        return self._neighbours
+
+    @property
+    def attenuation(self):
+        return self._attenuation
+
+    @property
+    def nbytes(self):
+        return (self._lat_lon.nbytes + self._distances.nbytes + self._neighbours.nbytes +
+                self._attenuation.nbytes)
+
+    def __contains__(self, province):
+        return province in self._index
+
+    def indices(self, provinces):
+        return np.array([self._index[province] for province in provinces], dtype=np.int64)
+
+    def etc_factors(self, etc_dict, target_indices):
+        # factor every target province's predictions get multiplied by, the
+        # product over all ETC sites of (1 - # of ETCs * attenuation)
+        if not etc_dict:
+            return np.ones(len(target_indices), dtype=np.float32)
+        etc_provinces = etc_dict.keys()
+        num_etcs = np.array([etc_dict[province] for province in etc_provinces], dtype=np.float64)
+        attenuation = self._attenuation[self.indices(etc_provinces)][:, target_indices]
+        return np.prod(1 - num_etcs[:, None] * attenuation, axis=0).astype(np.float32)
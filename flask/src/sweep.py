@@ -0,0 +1,219 @@
+# sweep.py
+#
+#===============================================================================
+# DESCRIPTION:
+#
+# Hyperparameter sweeps over pipeline_global.run_trial. A json spec lists the
+# values to try, either every combination (grid) or num_trials random draws:
+#
+#   {"search": "grid",
+#    "params": {"learning_rate": [1e-4, 1e-3], "hidden_size": [64, 128]},
+#    "fixed": {"max_epoch": 50}}
+#
+#   {"search": "random", "num_trials": 20, "seed": 0,
+#    "params": {"learning_rate": {"log_uniform": [1e-5, 1e-2]},
+#               "hidden_size": [64, 128, 256],
+#               "max_epoch": {"int": [20, 100]}}}
+#
+# Trials run in a process pool, each in a fresh process limited to --threads
+# threads. Every finished trial is cached as trials/<config hash>/result.json
+# in the sweep directory, so rerunning an interrupted sweep only runs the
+# missing trials. A sweep whose trials would find no training data (say a
+# num_timesteps that was never preprocessed) fails before any trial runs.
+# results.csv in the sweep directory holds one row per trial, best test rmse
+# first.
+#
+#===============================================================================
+# USAGE: python sweep.py spec.json [--sweep_dir sweep/] [--threads 2]
+#                        [--processes 4]
+#===============================================================================
+
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+import traceback
+
+# sweep.py itself doesn't import numpy or tensorflow, so the thread limits set
+# in the pool processes are in place before either starts its thread pools
+thread_env_vars = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']
+result_columns = ['status', 'test_rmse', 'train_loss', 'train_seconds', 'checkpoint', 'error']
+
+
+def _sample(rng, values):
+    # a list is a choice, {"uniform": [a, b]}, {"log_uniform": [a, b]} and
+    # {"int": [a, b]} are ranges including both ends
+    if isinstance(values, list):
+        return rng.choice(values)
+    (kind, (low, high)), = values.items()
+    if kind == 'uniform':
+        return rng.uniform(low, high)
+    if kind == 'log_uniform':
+        return math.exp(rng.uniform(math.log(low), math.log(high)))
+    if kind == 'int':
+        return rng.randint(low, high)
+    raise ValueError('unknown distribution {}'.format(kind))
+
+
+def expand_spec(spec):
+    # the trial configs of a spec, in order
+    fixed = spec.get('fixed', {})
+    params = spec.get('params', {})
+    names = sorted(params)
+    search = spec.get('search', 'grid')
+    if search == 'grid':
+        combinations = itertools.product(*[params[name] for name in names])
+        samples = [dict(zip(names, values)) for values in combinations]
+    elif search == 'random':
+        rng = random.Random(spec.get('seed', 0))
+        samples = [dict((name, _sample(rng, params[name])) for name in names)
+                   for _ in range(spec['num_trials'])]
+    else:
+        raise ValueError('unknown search {}, expected grid or random'.format(search))
+
+    configs = []
+    for sample in samples:
+        config = dict(fixed)
+        config.update(sample)
+        if config not in configs:
+            configs.append(config)
+    return configs
+
+
+def config_hash(config):
+    return hashlib.sha1(json.dumps(config, sort_keys=True)).hexdigest()[:12]
+
+
+def _result_path(sweep_dir, config):
+    return os.path.join(sweep_dir, 'trials', config_hash(config), 'result.json')
+
+
+def load_cached_result(sweep_dir, config):
+    path = _result_path(sweep_dir, config)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _init_worker(num_threads):
+    for name in thread_env_vars:
+        os.environ[name] = str(num_threads)
+
+
+def _missing_training_data(configs):
+    # runs in a pool process like the trials, see thread_env_vars
+    import pipeline_global
+    return [(config, pipeline_global.get_preprocessed_data_path(config)) for config in configs
+            if not pipeline_global.has_preprocessed_data(config)]
+
+
+def check_training_data(configs, num_threads=1):
+    # fails before any trial runs when some config, say a num_timesteps
+    # that was never preprocessed, has no training data
+    pool = multiprocessing.Pool(1, _init_worker, (num_threads,))
+    try:
+        missing = pool.apply(_missing_training_data, (configs,))
+    finally:
+        pool.terminate()
+        pool.join()
+    if missing:
+        paths = sorted(set(path for _, path in missing))
+        raise ValueError('{} of {} trials have no training data, preprocess {} first'.format(
+            len(missing), len(configs), ', '.join(paths)))
+
+
+def _run_trial(args):
+    # runs in a pool process, only successful trials are cached so failed
+    # ones are retried by the next run of the sweep
+    sweep_dir, config, num_threads = args
+    trial_directory = os.path.dirname(_result_path(sweep_dir, config))
+    try:
+        import pipeline_global
+        metrics = pipeline_global.run_trial(config, trial_directory, num_threads)
+    except Exception:
+        return {'config': config, 'status': 'failed', 'error': traceback.format_exc()}
+    result = {'config': config, 'status': 'done'}
+    result.update(metrics)
+    with open(_result_path(sweep_dir, config), 'w') as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+    return result
+
+
+def write_results_table(path, results):
+    # one row per trial, parameters first, best test rmse first
+    names = sorted(set(name for result in results for name in result['config']))
+    rows = sorted(results, key=lambda result: (result['status'] != 'done', result.get('test_rmse')))
+    with open(path, 'wb') as f:
+        writer = csv.writer(f, delimiter=',')
+        writer.writerow(['config_hash'] + names + result_columns)
+        for result in rows:
+            error = result.get('error', '')
+            writer.writerow([config_hash(result['config'])] +
+                            [result['config'].get(name, '') for name in names] +
+                            [result.get(column, '') for column in result_columns[:-1]] +
+                            [error.strip().splitlines()[-1] if error else ''])
+
+
+def run_sweep(spec, sweep_dir, num_threads=1, num_processes=None):
+    # runs the trials of spec that aren't cached in sweep_dir yet, and
+    # returns the results of all of them
+    if num_processes is None:
+        num_processes = max(1, multiprocessing.cpu_count() // num_threads)
+    configs = expand_spec(spec)
+    check_training_data(configs, num_threads)
+    results = {}
+    pending = []
+    for config in configs:
+        result = load_cached_result(sweep_dir, config)
+        if result is not None:
+            results[config_hash(config)] = result
+        else:
+            trial_directory = os.path.dirname(_result_path(sweep_dir, config))
+            if not os.path.exists(trial_directory):
+                os.makedirs(trial_directory)
+            pending.append(config)
+    print ("{} trials, {} cached, running {} on {} processes with {} threads each".format(
+        len(configs), len(results), len(pending), num_processes, num_threads))
+
+    table = os.path.join(sweep_dir, 'results.csv')
+    if pending:
+        # a fresh process per trial, run_trial sets pipeline_global's constants
+        pool = multiprocessing.Pool(num_processes, _init_worker, (num_threads,), maxtasksperchild=1)
+        try:
+            start = time.time()
+            tasks = [(sweep_dir, config, num_threads) for config in pending]
+            for i, result in enumerate(pool.imap_unordered(_run_trial, tasks)):
+                results[config_hash(result['config'])] = result
+                print ("[{}/{}] {} {} {}".format(i + 1, len(pending), result['status'],
+                                                 json.dumps(result['config'], sort_keys=True),
+                                                 result.get('test_rmse', '')))
+                # rewritten after every trial, so an interrupted sweep leaves a table
+                write_results_table(table, results.values())
+            print ("ran {} trials in {:.1f}s".format(len(pending), time.time() - start))
+        finally:
+            pool.terminate()
+            pool.join()
+    write_results_table(table, results.values())
+    print ("results written to {}".format(table))
+    return [results[config_hash(config)] for config in configs]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Hyperparameter sweeps')
+    parser.add_argument('spec', help='json sweep spec')
+    parser.add_argument('--sweep_dir', help='where trials and results go, next to the spec by default')
+    parser.add_argument('--threads', type=int, default=1, help='threads per trial')
+    parser.add_argument('--processes', type=int, help='trials run at once, cores / threads by default')
+    args = parser.parse_args()
+
+    with open(args.spec) as f:
+        spec = json.load(f)
+    sweep_dir = args.sweep_dir or os.path.splitext(args.spec)[0]
+    run_sweep(spec, sweep_dir, args.threads, args.processes)
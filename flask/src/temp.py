@@ -7,6 +7,7 @@ import models
 import sys
 import os
 import data_loader
+import dataset_format
 
 from collections import defaultdict
 
@@ -22,20 +23,19 @@ tf.set_random_seed(0)
 
 parser = argparse.ArgumentParser(description='Epidemic Response System')
 parser.add_argument('-wd', '--working_directory', help='directory for storing logs')
-parser.add_argument('-sf', '--save_frequency', help='Number of epochs before saving')
+parser.add_argument('-sf', '--save_frequency', type=int, help='Number of epochs before saving')
 parser.add_argument('--model_path', help='Stored model path')
+parser.add_argument('--batch_size', '--batch-size', type=int, default=1, help='sequences per training step')
 parser.add_argument('mode', choices=('train', 'eval', 'extrapolate', 'etc_user'), help='train or eval')
 args = parser.parse_args()
 
 # Training Constants
 learning_rate = 1e-4
-batch_size = 1
+batch_size = args.batch_size
 num_timesteps = 25
 num_feats = 3
 max_epoch = 601
 num_extrapolate = 20
-dataset_size = 3069
-updates_per_epoch = int(np.ceil(float(dataset_size) / float(batch_size)))
 
 if args.working_directory:
     working_directory = args.working_directory
@@ -51,8 +51,7 @@ else:
     model_path = 'trial/checkpoints/model.ckpt-600'
 
 def get_loss(pred, gt):
-    return tf.div(tf.reduce_mean(tf.square(tf.sub(gt, pred))),
-                  tf.constant(float(batch_size)))
+    return tf.reduce_mean(tf.square(tf.sub(gt, tf.reshape(pred, [-1]))))
 
 def train():
     with tf.device('/gpu:0'): # run on specific device
@@ -64,6 +63,7 @@ def train():
         train = optimizer.minimize(loss=loss)
 
     dataset = data_loader.read_datasets(PREPROCESSED_DATA)
+    updates_per_epoch = dataset.num_examples // batch_size
     saver = tf.train.Saver()  # defaults to saving all variables
 
     # logging the loss function
@@ -90,7 +90,7 @@ def train():
                 input_batch, gt_batch = dataset.next_batch(batch_size)
                 _, loss_value = sess.run([train, loss],
                                          {input_tensor : input_batch,
-                                          gt : [gt_batch]})
+                                          gt : gt_batch})
                 training_loss += np.sum(loss_value)
 
             training_loss = training_loss/(updates_per_epoch)
@@ -107,7 +107,7 @@ def train():
                 # save summaries
                 summary_str = sess.run(merged,
                               feed_dict={input_tensor : input_batch,
-                                         gt : [gt_batch],
+                                         gt : gt_batch,
                                          loss_placeholder: training_loss})
                 writer.add_summary(summary_str, global_step=epoch)
         writer.close()
@@ -118,30 +118,33 @@ def evaluate(print_grid=False):
                                                      num_feats,
                                                      batch_size)
 
-    dataset = data_loader.read_datasets(PREPROCESSED_DATA, dataset_type='test')
+    dataset = data_loader.read_datasets(PREPROCESSED_DATA, dataset_type='test',
+                                        partial_last_batch=True)
 
     saver = tf.train.Saver()
 
     with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as sess:
         saver.restore(sess, model_path)
 
+        # every test example is scored, the last batch is zero padded up to
+        # batch_size and only its real rows are kept
         all_pred, all_gt = [], []
-        for i in range(updates_per_epoch):
+        for i in range(-(-dataset.num_examples // batch_size)):
             input_batch, gt_batch = dataset.next_batch(batch_size)
-            pred_value = sess.run([pred],
-                                  {input_tensor : input_batch,
-                                   gt : [gt_batch]})
+            num_rows = len(gt_batch)
+            padded_gt = data_loader.pad_batch(gt_batch, batch_size)
+            pred_value = sess.run(pred,
+                                  {input_tensor : data_loader.pad_batch(input_batch, batch_size),
+                                   gt : padded_gt})
 
-            all_pred.append(pred_value)
+            all_pred.append(np.reshape(pred_value, np.shape(padded_gt))[:num_rows])
             all_gt.append(gt_batch)
 
-        num_align = 0
-        rmse = []
-        for i in range(len(all_pred)):
-            if all_pred[i] == all_gt[i]: num_align += 1
-            rmse.append(np.sqrt(np.power((all_pred[i] - all_gt[i]), 2)))
+        all_pred = np.concatenate(all_pred)
+        all_gt = np.concatenate(all_gt)
+        rmse = np.sqrt(np.power((all_pred - all_gt), 2))
 
-        print "Accuracy:", float(num_align)/len(all_pred)
+        print "Accuracy:", np.mean(all_pred == all_gt)
         print "Avg. RMSE", np.mean(rmse)
         print "Variance RMSE", np.var(rmse)
 
@@ -164,12 +167,13 @@ def extrapolate(history_file, etc_dict=None):
     global sess
     # etc_dict is a dict mapping from province to # of new ETCs there
     with tf.device('/gpu:0'):  # run on specific device
+        # one province window at a time
         input_tensor, pred, gt = models.import_model(num_timesteps,
                                                      num_feats,
-                                                     batch_size)
+                                                     1)
 
     # dataset should be [num_provinces x (num_timesteps, num_feats)]
-    data, provinces = np.load(history_file)
+    data, provinces = dataset_format.load_history(history_file)
 
     saver = tf.train.Saver()
 
@@ -187,7 +191,7 @@ def extrapolate(history_file, etc_dict=None):
             old_value = province_data[-1, 0]
             for t in range(num_extrapolate):
                 pred_value = sess.run([pred],
-                                      {input_tensor: province_data})[0][0][0]
+                                      {input_tensor: [province_data]})[0][0][0]
                 if pred_value < 0:
                     pred_value = 0
                 extrapolated.append(pred_value)